@@ -0,0 +1,62 @@
+import com.android.tools.r8.CompilationFailedException;
+import com.android.tools.r8.D8;
+import com.android.tools.r8.D8Command;
+import com.android.tools.r8.origin.Origin;
+
+import java.io.BufferedReader;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.List;
+
+/**
+ * Runs D8 requests one after another in single warm JVM. Every line of
+ * standard input is path to request file containing one argument per
+ * line; diagnostics are written beside it into file with `.log` suffix
+ * and result code is answered with line of standard output.
+ */
+public final class D8Worker {
+	public static void main(String[] args) throws IOException {
+		PrintStream protocol = System.out;
+		BufferedReader input = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+		String line;
+		while ((line = input.readLine()) != null) {
+			if (line.isEmpty()) {
+				continue;
+			}
+			int result = run(Paths.get(line));
+			protocol.println(result);
+			protocol.flush();
+		}
+	}
+
+	private static int run(Path request) {
+		Path log = request.resolveSibling(request.getFileName() + ".log");
+		PrintStream out = System.out;
+		PrintStream err = System.err;
+		try (PrintStream stream = new PrintStream(Files.newOutputStream(log), true, "UTF-8")) {
+			System.setOut(stream);
+			System.setErr(stream);
+			try {
+				List<String> arguments = Files.readAllLines(request, StandardCharsets.UTF_8);
+				D8.run(D8Command.parse(arguments.toArray(new String[0]), Origin.root()).build());
+				return 0;
+			} catch (CompilationFailedException exc) {
+				return 1;
+			} catch (Throwable exc) {
+				exc.printStackTrace(stream);
+				return 2;
+			} finally {
+				System.setOut(out);
+				System.setErr(err);
+			}
+		} catch (IOException exc) {
+			exc.printStackTrace(err);
+			return 3;
+		}
+	}
+}
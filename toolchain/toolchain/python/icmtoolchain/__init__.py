@@ -39,7 +39,11 @@ class Globals:
 		if not hasattr(self, "build_storage"):
 			from .hash_storage import HashStorage
 			self.build_storage = HashStorage(self.MAKE_CONFIG.get_build_path(".buildrc"), \
-				    self.MAKE_CONFIG.get_value("development.comparingMode", "content"))
+				    self.MAKE_CONFIG.get_value("development.comparingMode", "content"), \
+				    self.MAKE_CONFIG.get_value("development.hashingThreads", 0), \
+				    self.MAKE_CONFIG.get_value("development.storageGenerations", 32), \
+				    self.MAKE_CONFIG.get_value("development.storageEntries", 262144), \
+				    self.CHANGE_JOURNAL)
 		return self.build_storage
 
 	@property
@@ -47,9 +51,44 @@ class Globals:
 		if not hasattr(self, "output_storage"):
 			from .hash_storage import HashStorage
 			self.output_storage = HashStorage(self.MAKE_CONFIG.get_build_path(".outputrc"), \
-				     self.MAKE_CONFIG.get_value("development.comparingMode", "content"))
+				     self.MAKE_CONFIG.get_value("development.comparingMode", "content"), \
+				     self.MAKE_CONFIG.get_value("development.hashingThreads", 0), \
+				     self.MAKE_CONFIG.get_value("development.storageGenerations", 32), \
+				     self.MAKE_CONFIG.get_value("development.storageEntries", 262144), \
+				     self.CHANGE_JOURNAL)
 		return self.output_storage
 
+	@property
+	def CHANGE_JOURNAL(self):
+		if not hasattr(self, "change_journal"):
+			from .watcher import ChangeJournal, get_journal_path, start_watcher
+			self.change_journal = ChangeJournal(get_journal_path(self.MAKE_CONFIG.get_build_path("")))
+			if self.MAKE_CONFIG.get_value("development.watchChanges", False) and not self.change_journal.is_alive():
+				start_watcher(self.change_journal.path, self.get_watched_directories())
+		return self.change_journal
+
+	@property
+	def ARTIFACT_CACHE(self):
+		if not hasattr(self, "artifact_cache"):
+			from .artifact_cache import ArtifactCache
+			mirror = self.TOOLCHAIN_CONFIG.get_value("cache.mirror")
+			self.artifact_cache = ArtifactCache(self.TOOLCHAIN_CONFIG.get_absolute_path(self.TOOLCHAIN_CONFIG.get_value("cache.directory", "toolchain/cache")), \
+				      self.TOOLCHAIN_CONFIG.get_absolute_path(mirror) if mirror else None, \
+				      self.TOOLCHAIN_CONFIG.get_value("cache.maxSize", 2048) * 1048576, \
+				      self.TOOLCHAIN_CONFIG.get_value("cache.enabled", True))
+		return self.artifact_cache
+
+	@property
+	def D8_WORKER(self):
+		if not hasattr(self, "d8_worker"):
+			from .d8_worker import D8Worker
+			from .jobs import get_jobs_count
+			self.d8_worker = D8Worker(self.TOOLCHAIN_CONFIG.get_path("toolchain/bin/D8Worker.java"), \
+				      self.TOOLCHAIN_CONFIG.get_path("toolchain/bin/r8/r8.jar"), \
+				      self.TOOLCHAIN_CONFIG.get_path("toolchain/temp/d8worker"), \
+				      get_jobs_count(self.PREFERRED_CONFIG.get_value("java.jobs")))
+		return self.d8_worker
+
 	@property
 	def LINKED_RESOURCE_STORAGE(self):
 		if not hasattr(self, "linked_resource_storage"):
@@ -163,8 +202,36 @@ class Globals:
 			self.parameter_signature = inspect.Signature(parameters, return_annotation=int)
 		return self.parameter_signature
 
+	def get_watched_directories(self):
+		return [self.MAKE_CONFIG.directory, self.MOD_STRUCTURE.directory, self.MAKE_CONFIG.get_build_path("")]
+
+	def ensure_initialized(self, *properties):
+		"""
+		Creates lazily initialized properties beforehand, they are not
+		guarded by locks, so worker threads must only use them after
+		they were created on main thread.
+		"""
+		for property in properties:
+			getattr(self, property)
+
+	def flush_storages(self):
+		if hasattr(self, "build_storage"):
+			self.build_storage.flush()
+		if hasattr(self, "output_storage"):
+			self.output_storage.flush()
+		if hasattr(self, "artifact_cache"):
+			self.artifact_cache.flush()
+		# Files written during task must not be trusted as unchanged by next ones.
+		if hasattr(self, "change_journal"):
+			self.change_journal.invalidate()
+
 	def shutdown(self):
 		self.shutdown_project()
+		if hasattr(self, "artifact_cache"):
+			del self.artifact_cache
+		if hasattr(self, "d8_worker"):
+			self.d8_worker.close()
+			del self.d8_worker
 		if hasattr(self, "code_settings"):
 			del self.code_settings
 		if hasattr(self, "code_workspace"):
@@ -177,10 +244,13 @@ class Globals:
 			del self.toolchain_config
 
 	def shutdown_project(self):
+		self.flush_storages()
 		if hasattr(self, "adb_command"):
 			del self.adb_command
 		if hasattr(self, "build_storage"):
 			del self.build_storage
+		if hasattr(self, "change_journal"):
+			del self.change_journal
 		if hasattr(self, "make_config"):
 			del self.make_config
 		if hasattr(self, "mod_structure"):
@@ -197,7 +267,8 @@ class Globals:
 GLOBALS = Globals()
 
 PARAMETERS = {
-	"release": bool
+	"release": bool,
+	"jobs": int
 }
 
 PROPERTIES = BaseConfig()
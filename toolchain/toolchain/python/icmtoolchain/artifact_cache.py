@@ -0,0 +1,185 @@
+import os
+import platform
+import shutil
+import subprocess
+import threading
+import time
+from os.path import basename, dirname, isdir, isfile, join
+from typing import Dict, Final, Iterable, List, Optional, Tuple
+
+try:
+	from hashlib import blake2s as encode
+except ImportError:
+	from hashlib import md5 as encode
+
+# Increment whenever artifacts are keyed or packed differently.
+CACHE_VERSION = 1
+
+TOOL_IDENTITIES: Dict[Tuple[str, ...], str] = dict()
+# Lines of version output referring to location of tool itself (Clang),
+# which differs between checkouts.
+LOCATION_PREFIXES = ("InstalledDir:", "Configuration file:")
+
+
+def get_tool_identity(command: Iterable[str]) -> str:
+	"""
+	Describes tool by its version output, so artifacts produced by
+	another compiler build are never reused; results are memoized.
+	"""
+	command = tuple(command)
+	if command not in TOOL_IDENTITIES:
+		try:
+			result = subprocess.run(list(command) + ["--version"], text=True, capture_output=True, shell=platform.system() == "Windows" and command[0].endswith((".cmd", ".bat")))
+			TOOL_IDENTITIES[command] = "\n".join(
+				line for line in (result.stdout or result.stderr).strip().splitlines() if not line.startswith(LOCATION_PREFIXES)
+			) if result.returncode == 0 else ""
+		except OSError:
+			TOOL_IDENTITIES[command] = ""
+	return TOOL_IDENTITIES[command]
+
+
+class ArtifactCache:
+	"""
+	Content-addressed storage of build outputs, artifacts are keyed
+	by tool, its version, flags and digest of inputs, so they may be
+	shared between projects. Least recently used artifacts are evicted
+	when cache exceeds size limit; optional mirror is a plain folder
+	(e.g. network share), which is consulted on local misses.
+	"""
+	directory: Final[str]
+	mirror: Final[Optional[str]]
+	max_size: Final[int]
+	enabled: Final[bool]
+	pending: bool
+
+	def __init__(self, directory: str, mirror: Optional[str] = None, max_size: int = 2147483648, enabled: bool = True) -> None:
+		self.directory = directory
+		self.mirror = mirror
+		self.max_size = max_size
+		self.enabled = enabled
+		self.pending = False
+		self.lock = threading.Lock()
+
+	@staticmethod
+	def get_key(tool: str, version: str, flags: Iterable[str], digest: str) -> str:
+		key = encode(bytes(str(CACHE_VERSION), "utf-8"))
+		for value in (tool, version, *flags, digest):
+			key.update(bytes(value, "utf-8"))
+			key.update(b"\0")
+		return key.hexdigest()
+
+	@staticmethod
+	def get_entry_path(directory: str, key: str) -> str:
+		return join(directory, key[:2], key)
+
+	@staticmethod
+	def copy_atomically(source: str, destination: str) -> None:
+		os.makedirs(dirname(destination), exist_ok=True)
+		temporary_destination = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+		try:
+			shutil.copyfile(source, temporary_destination)
+			os.replace(temporary_destination, destination)
+		finally:
+			if isfile(temporary_destination):
+				os.remove(temporary_destination)
+
+	def lookup(self, key: str) -> Optional[str]:
+		"""
+		Returns local path of artifact, downloading it from mirror
+		when necessary; access time is recorded for eviction.
+		"""
+		if not self.enabled:
+			return None
+		entry = ArtifactCache.get_entry_path(self.directory, key)
+		if not isfile(entry) and self.mirror:
+			mirrored_entry = ArtifactCache.get_entry_path(self.mirror, key)
+			try:
+				if isfile(mirrored_entry):
+					ArtifactCache.copy_atomically(mirrored_entry, entry)
+			except OSError as exc:
+				from .shell import debug
+				debug(f"* Artifact mirror {self.mirror!r} is not available: {exc}")
+		if not isfile(entry):
+			return None
+		try:
+			os.utime(entry)
+		except OSError:
+			pass
+		return entry
+
+	def fetch(self, key: str, destination: str) -> bool:
+		entry = self.lookup(key)
+		if not entry:
+			return False
+		try:
+			ArtifactCache.copy_atomically(entry, destination)
+			return True
+		except OSError:
+			return False
+
+	def store(self, key: str, source: str) -> None:
+		if not self.enabled or not isfile(source):
+			return
+		entry = ArtifactCache.get_entry_path(self.directory, key)
+		try:
+			ArtifactCache.copy_atomically(source, entry)
+		except OSError as exc:
+			from .shell import warn
+			warn(f"* Artifact {basename(source)!r} could not be cached: {exc}")
+			return
+		with self.lock:
+			self.pending = True
+		if self.mirror:
+			try:
+				mirrored_entry = ArtifactCache.get_entry_path(self.mirror, key)
+				if not isfile(mirrored_entry):
+					ArtifactCache.copy_atomically(entry, mirrored_entry)
+			except OSError as exc:
+				from .shell import debug
+				debug(f"* Artifact mirror {self.mirror!r} is not writable: {exc}")
+
+	def list_entries(self) -> List[Tuple[float, int, str]]:
+		entries = list()
+		if not isdir(self.directory):
+			return entries
+		for dirpath, dirnames, filenames in os.walk(self.directory):
+			for filename in filenames:
+				path = join(dirpath, filename)
+				try:
+					stat = os.stat(path)
+				except OSError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, path))
+		return entries
+
+	def collect(self, max_size: Optional[int] = None) -> int:
+		"""
+		Evicts least recently used artifacts until cache fits into
+		size limit, returns count of evicted artifacts; mirror is never
+		evicted, it is expected to be maintained separately.
+		"""
+		if max_size is None:
+			max_size = self.max_size
+		self.pending = False
+		if max_size <= 0:
+			return 0
+		entries = self.list_entries()
+		total_size = sum(size for _, size, _ in entries)
+		evicted = 0
+		for mtime, size, path in sorted(entries):
+			if total_size <= max_size:
+				break
+			# Temporary files of concurrent builds should not be touched.
+			if path.endswith((".tmp", ".zip")) and time.time() - mtime < 3600:
+				continue
+			try:
+				os.remove(path)
+				total_size -= size
+				evicted += 1
+			except OSError:
+				pass
+		return evicted
+
+	def flush(self) -> None:
+		if self.pending:
+			self.collect()
@@ -0,0 +1,177 @@
+import os
+import subprocess
+import threading
+from os.path import getmtime, isfile, join
+from typing import List, Optional, Tuple
+
+from .utils import ensure_directory, request_tool
+
+
+class D8Worker:
+	"""
+	Long-lived JVMs running D8 requests, so JVM startup and JIT warmup
+	are paid once per toolchain run; up to limited count of them serve
+	concurrently dexed targets. Requests are run in one-shot JVMs whenever
+	worker could not be started or died.
+	"""
+	processes: List['subprocess.Popen[str]']
+	idle: List['subprocess.Popen[str]']
+
+	def __init__(self, source: str, r8_jar: str, directory: str, max_processes: int = 1) -> None:
+		self.source = source
+		self.r8_jar = r8_jar
+		self.directory = directory
+		self.max_processes = max(1, max_processes)
+		self.processes = list()
+		self.idle = list()
+		self.prepared = False
+		self.available = True
+		self.requests = 0
+		self.condition = threading.Condition()
+
+	def prepare(self) -> bool:
+		"""
+		Compiles worker into directory, when its classes are missing
+		or outdated; javac is required only once.
+		"""
+		compiled = join(self.directory, "D8Worker.class")
+		if isfile(compiled) and getmtime(compiled) >= max(getmtime(self.source), getmtime(self.r8_jar)):
+			return True
+		javac_executable = request_tool("javac")
+		if not javac_executable:
+			return False
+		ensure_directory(self.directory)
+		result = subprocess.run([
+			javac_executable,
+			"-classpath", self.r8_jar,
+			"-d", self.directory,
+			self.source
+		], text=True, capture_output=True)
+		if result.returncode != 0:
+			from .shell import debug
+			debug(f"* D8 worker could not be compiled: {result.stderr.strip()}")
+		return result.returncode == 0
+
+	def start(self, java_executable: str) -> Optional['subprocess.Popen[str]']:
+		try:
+			return subprocess.Popen([
+				java_executable,
+				"-classpath", os.pathsep.join((self.directory, self.r8_jar)),
+				"D8Worker"
+			], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+		except OSError:
+			return None
+
+	def acquire(self, java_executable: str) -> Optional['subprocess.Popen[str]']:
+		"""
+		Takes idle worker or starts another one, while their count is
+		below limit; otherwise waits until any of them is released.
+		"""
+		with self.condition:
+			while self.available:
+				if len(self.idle) > 0:
+					return self.idle.pop()
+				if len(self.processes) < self.max_processes:
+					if not self.prepared:
+						self.available = self.prepare()
+						self.prepared = True
+						if not self.available:
+							break
+					process = self.start(java_executable)
+					if not process:
+						self.available = False
+						break
+					self.processes.append(process)
+					return process
+				self.condition.wait()
+			return None
+
+	def release(self, process: 'subprocess.Popen[str]') -> None:
+		with self.condition:
+			self.idle.append(process)
+			self.condition.notify()
+
+	def discard(self, process: 'subprocess.Popen[str]') -> None:
+		D8Worker.stop(process)
+		with self.condition:
+			if process in self.processes:
+				self.processes.remove(process)
+			self.available = False
+			self.condition.notify_all()
+
+	@staticmethod
+	def expand_arguments(arguments: List[str]) -> List[str]:
+		expanded_arguments = list()
+		for argument in arguments:
+			if argument.startswith("@") and isfile(argument[1:]):
+				with open(argument[1:], encoding="utf-8") as file:
+					expanded_arguments.extend(line.rstrip("\r\n") for line in file if line.strip())
+			else:
+				expanded_arguments.append(argument)
+		return expanded_arguments
+
+	def request(self, process: 'subprocess.Popen[str]', arguments: List[str]) -> Optional[Tuple[int, str]]:
+		with self.condition:
+			self.requests += 1
+			request = join(self.directory, f"request-{os.getpid()}-{self.requests}.txt")
+		with open(request, "w", encoding="utf-8") as file:
+			file.writelines(argument + "\n" for argument in D8Worker.expand_arguments(arguments))
+		if not process.stdin or not process.stdout:
+			return None
+		try:
+			process.stdin.write(request + "\n")
+			process.stdin.flush()
+			answer = process.stdout.readline()
+		except OSError:
+			answer = ""
+		output = ""
+		try:
+			if isfile(request + ".log"):
+				with open(request + ".log", encoding="utf-8", errors="replace") as file:
+					output = file.read()
+				os.remove(request + ".log")
+			os.remove(request)
+		except OSError:
+			pass
+		try:
+			return int(answer), output
+		except ValueError:
+			return None
+
+	def run(self, java_executable: str, arguments: List[str], enabled: bool = True) -> Tuple[int, str]:
+		"""
+		Dexes with arguments of D8 command line, returns result code
+		and diagnostics of compiler.
+		"""
+		process = self.acquire(java_executable) if enabled else None
+		if process:
+			result = self.request(process, arguments)
+			if result:
+				self.release(process)
+				return result
+			self.discard(process)
+			from .shell import warn
+			warn("* D8 worker stopped responding, following requests will be run separately.")
+		result = subprocess.run([
+			java_executable,
+			"-classpath", self.r8_jar,
+			"com.android.tools.r8.D8"
+		] + arguments, text=True, capture_output=True)
+		return result.returncode, result.stderr
+
+	@staticmethod
+	def stop(process: 'subprocess.Popen[str]') -> None:
+		try:
+			if process.stdin:
+				process.stdin.close()
+			process.wait(timeout=5)
+		except (OSError, subprocess.TimeoutExpired):
+			process.kill()
+
+	def close(self) -> None:
+		with self.condition:
+			processes = self.processes
+			self.processes = list()
+			self.idle = list()
+		for process in processes:
+			D8Worker.stop(process)
@@ -234,10 +234,14 @@ def push_file(file: str, destination_file: str, push_unchanged: bool = True, cle
 	return result.returncode
 
 def push_directory(directory: str, destination_directory: str, push_unchanged: bool = True, cleanup_remote: bool = True, shell: Optional[Shell] = None) -> int:
-	items = [
-		relpath(path, directory) for path in glob(directory + "/*") \
-			if push_unchanged or GLOBALS.OUTPUT_STORAGE.is_path_changed(path)
-	]
+	if push_unchanged:
+		items = [
+			relpath(path, directory) for path in glob(directory + "/*")
+		]
+	else:
+		# Directory manifest contains digests of every entry, so it is
+		# enough to compare them instead of walking each entry again.
+		items = GLOBALS.OUTPUT_STORAGE.get_modified_entries(directory)
 	if len(items) == 0:
 		return 0
 	directory_basename = basename(directory)
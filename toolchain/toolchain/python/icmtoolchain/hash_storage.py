@@ -1,39 +1,233 @@
-import json
 import os
+import sqlite3
+import threading
+import time
+import unicodedata
 from errno import ENOENT
 from os.path import (basename, dirname, getmtime, getsize, isdir, isfile,
-                     islink, join)
-from typing import Collection, Dict, Final, List
+                     islink, join, normpath)
+from typing import (Any, Callable, Collection, Dict, Final, Iterable, List,
+                    Optional, Tuple)
 
-from .utils import get_all_files
+from .watcher import ChangeJournal
 
 try:
 	from hashlib import blake2s as encode
 except ImportError:
 	from hashlib import md5 as encode
 
+CHUNK_SIZE = 1048576
+# Seconds to wait for storage being written by another toolchain process.
+LOCK_TIMEOUT = 30.0
+
+# Increment whenever digests are computed differently, storages
+# written with other versions are discarded instead of being trusted.
+FORMAT_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+	key BLOB PRIMARY KEY,
+	hash BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+	key BLOB PRIMARY KEY,
+	inode INTEGER NOT NULL,
+	size INTEGER NOT NULL,
+	mtime INTEGER NOT NULL,
+	hash BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifests (
+	directory BLOB NOT NULL,
+	kind INTEGER NOT NULL,
+	path TEXT NOT NULL,
+	hash BLOB NOT NULL,
+	PRIMARY KEY (directory, kind, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS generations (
+	key BLOB PRIMARY KEY,
+	generation INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS generations_order ON generations (generation);
+CREATE TABLE IF NOT EXISTS metadata (
+	name TEXT PRIMARY KEY,
+	value INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+TABLES = ("hashes", "stats", "manifests", "generations", "metadata")
+
+MANIFEST_SECTIONS = ("files", "directories")
+
+
+def get_hashing_threads(threads: int = 0) -> int:
+	if threads > 0:
+		return threads
+	return min(32, (os.cpu_count() or 1) + 4)
+
+def digest_concurrently(paths: List[str], digest: Callable[[str], str], threads: int = 0) -> List[str]:
+	"""
+	Digests files using pool of worker threads, which are fed from
+	bounded queue; hashlib releases GIL for large buffers, so threads
+	scale well on fast drives. Results preserve order of paths.
+	"""
+	threads = min(get_hashing_threads(threads), len(paths))
+	if threads <= 1:
+		return [digest(path) for path in paths]
+	from queue import Queue
+	digests: List[str] = [""] * len(paths)
+	failures: List[BaseException] = list()
+	queue: Queue = Queue(maxsize=threads * 4)
+
+	def worker() -> None:
+		while True:
+			index = queue.get()
+			if index is None:
+				break
+			if len(failures) == 0:
+				try:
+					digests[index] = digest(paths[index])
+				except BaseException as exc:
+					failures.append(exc)
+
+	workers = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+	for thread in workers:
+		thread.start()
+	try:
+		for index in range(len(paths)):
+			if len(failures) != 0:
+				break
+			queue.put(index)
+	finally:
+		for _ in workers:
+			queue.put(None)
+		for thread in workers:
+			thread.join()
+	if len(failures) != 0:
+		raise failures[0]
+	return digests
+
 class HashStorage:
 	last_hashes: Dict[str, str]
 	hashes: Dict[str, str]
+	last_stats: Dict[str, List[Any]]
+	stats: Dict[str, List[Any]]
+	last_manifests: Dict[str, Dict[str, Dict[str, str]]]
+	manifests: Dict[str, Dict[str, Dict[str, str]]]
+	saved_hashes: Dict[str, str]
+	saved_stats: Dict[str, List[Any]]
+	saved_manifests: Dict[str, Dict[str, Dict[str, str]]]
+	last_generations: Dict[str, int]
+	last_started: Dict[int, int]
+	generation: int
+	started: int
+	pending: bool
 	path: Final[str]
+	journal: Optional[ChangeJournal]
 
-	def __init__(self, path: str, comparing_mode: str = "content") -> None:
+	def __init__(self, path: str, comparing_mode: str = "content", threads: int = 0, max_generations: int = 32, max_entries: int = 262144, journal: Optional[ChangeJournal] = None) -> None:
 		self.path = path
 		self.hashes = dict()
 		self.comparing_mode = comparing_mode
+		self.threads = threads
+		self.max_generations = max_generations
+		self.max_entries = max_entries
+		self.journal = journal
 		self.read()
 
 	def read(self) -> None:
 		self.last_hashes = dict()
 		self.hashes = dict()
+		self.last_stats = dict()
+		self.stats = dict()
+		self.last_manifests = dict()
+		self.manifests = dict()
+		self.saved_hashes = dict()
+		self.saved_stats = dict()
+		self.saved_manifests = dict()
+		self.last_generations = dict()
+		self.last_started = dict()
+		self.generation = 1
+		self.started = time.time_ns()
+		self.pending = False
+
+		if not isfile(self.path):
+			return
+		connection = self.connect()
+		if not connection:
+			return
+		try:
+			for key, hash in connection.execute("SELECT key, hash FROM hashes"):
+				self.last_hashes[key.hex()] = hash.hex()
+			# Stat signatures are stored next to digests, keys are always encoded paths.
+			for key, inode, size, mtime, hash in connection.execute("SELECT key, inode, size, mtime, hash FROM stats"):
+				self.last_stats[key.hex()] = [inode, size, mtime, hash.hex()]
+			for directory, kind, path, hash in connection.execute("SELECT directory, kind, path, hash FROM manifests"):
+				encoded = directory.hex()
+				if encoded not in self.last_manifests:
+					self.last_manifests[encoded] = {section: dict() for section in MANIFEST_SECTIONS}
+				self.last_manifests[encoded][MANIFEST_SECTIONS[kind]][path] = hash.hex()
+			for key, generation in connection.execute("SELECT key, generation FROM generations"):
+				self.last_generations[key.hex()] = generation
+			for (generation, ) in connection.execute("SELECT value FROM metadata WHERE name = 'generation'"):
+				self.generation = generation + 1
+			for name, started in connection.execute("SELECT name, value FROM metadata WHERE name LIKE 'started.%'"):
+				self.last_started[int(name[8:])] = started
+		except sqlite3.OperationalError as exc:
+			raise self.get_lock_error(exc)
+		except (sqlite3.DatabaseError, IndexError, ValueError):
+			from .shell import warn
+			warn(f"* Malformed {basename(self.path)!r}, prebuilt caches will be ignored...")
+			self.last_hashes = dict()
+			self.last_stats = dict()
+			self.last_manifests = dict()
+			self.last_generations = dict()
+			self.last_started = dict()
+		finally:
+			connection.close()
 
+	def get_lock_error(self, exc: sqlite3.OperationalError) -> Exception:
+		from .utils import RuntimeCodeError
+		return RuntimeCodeError(1, f"Storage {basename(self.path)!r} could not be accessed, probably another build is running: {exc}")
+
+	def connect(self) -> Optional[sqlite3.Connection]:
+		"""
+		Opens storage database, creating it when necessary; databases
+		written in another format or legacy JSON storages are dropped,
+		so everything will be rehashed instead of being trusted.
+		"""
 		if isfile(self.path):
-			with open(self.path, "r") as file:
-				try:
-					self.last_hashes = json.load(file)
-				except json.JSONDecodeError:
-					from .shell import warn
-					warn(f"* Malformed {basename(self.path)!r}, prebuilt caches will be ignored...")
+			with open(self.path, "rb") as file:
+				header = file.read(16)
+			if len(header) > 0 and header != b"SQLite format 3\0":
+				from .shell import info
+				info(f"* Storage {basename(self.path)!r} was written in legacy format, it will be migrated to format {FORMAT_VERSION} by rehashing everything...")
+				os.remove(self.path)
+		os.makedirs(dirname(self.path), exist_ok=True)
+		connection = None
+		try:
+			connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+			version = connection.execute("PRAGMA user_version").fetchone()[0]
+			if version != FORMAT_VERSION:
+				if version != 0:
+					from .shell import info
+					info(f"* Storage {basename(self.path)!r} was written in format {version}, it will be migrated to format {FORMAT_VERSION} by rehashing everything...")
+				connection.executescript("".join(f"DROP TABLE IF EXISTS {table};" for table in TABLES))
+			connection.executescript(SCHEMA)
+			connection.execute(f"PRAGMA user_version = {FORMAT_VERSION}")
+			connection.execute("PRAGMA synchronous = NORMAL")
+			return connection
+		except sqlite3.OperationalError as exc:
+			# Storage is locked by another toolchain process, it must never be removed then.
+			if connection:
+				connection.close()
+			raise self.get_lock_error(exc)
+		except sqlite3.DatabaseError:
+			if connection:
+				connection.close()
+			from .shell import warn
+			warn(f"* Malformed {basename(self.path)!r}, prebuilt caches will be ignored...")
+			os.remove(self.path)
+		return None
 
 	def get_path_hash(self, path: str, force: bool = False) -> str:
 		encoded = encode(bytes(path, "utf-8")).hexdigest()
@@ -41,15 +235,121 @@ class HashStorage:
 			return self.hashes[encoded]
 
 		if isfile(path) or islink(path):
-			hash = HashStorage.get_file_hash(path, comparing_mode=self.comparing_mode)
+			hash = self.last_hashes[encoded] if not force and self.is_journaled(encoded, path) else self.get_file_digest(path)
 		elif isdir(path):
-			hash = HashStorage.get_directory_hash(path, comparing_mode=self.comparing_mode)
+			hash = self.get_directory_manifest(path, force)[0]
 		else:
 			raise FileNotFoundError(ENOENT, os.strerror(ENOENT), path)
 
 		self.hashes[encoded] = hash
 		return hash
 
+	def get_hybrid_file_hash(self, path: str) -> str:
+		"""
+		Hashes file contents only when inode, size or modification
+		time changed since signature was recorded, otherwise reuses
+		previously computed digest.
+		"""
+		encoded = encode(bytes(path, "utf-8")).hexdigest()
+		stat = os.stat(path)
+		signature = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+		cached = self.stats.get(encoded) or self.last_stats.get(encoded)
+		if isinstance(cached, list) and len(cached) == 4 and cached[:3] == signature:
+			hash = cached[3]
+		else:
+			hash = HashStorage.get_file_hash(path, comparing_mode="content")
+		self.stats[encoded] = signature + [hash]
+		return hash
+
+	def get_file_digest(self, path: str) -> str:
+		if self.comparing_mode == "hybrid":
+			return self.get_hybrid_file_hash(path)
+		return HashStorage.get_file_hash(path, comparing_mode=self.comparing_mode)
+
+	def get_directory_manifest(self, directory: str, force: bool = False) -> Tuple[str, Dict[str, Dict[str, str]]]:
+		"""
+		Computes Merkle manifest of directory, which maps relative
+		file paths and subtrees to their digests, root digest is
+		returned with manifest itself.
+		"""
+		encoded = encode(bytes(directory, "utf-8")).hexdigest()
+		if not force and encoded in self.manifests and encoded in self.hashes:
+			return self.hashes[encoded], self.manifests[encoded]
+		if not force and encoded in self.last_manifests and self.is_journaled(encoded, directory):
+			hash, manifest = self.last_hashes[encoded], self.last_manifests[encoded]
+		else:
+			hash, manifest = HashStorage.build_manifest(directory, self.get_file_digest, self.threads)
+		self.manifests[encoded] = manifest
+		self.hashes[encoded] = hash
+		return hash, manifest
+
+	def is_journaled(self, encoded: str, path: str) -> bool:
+		"""
+		Whether change journal guarantees that path was not touched
+		since digest of it was recorded, so it may be reused without
+		reading anything; digest generations are refreshed lazily,
+		so start of recorded generation is conservative moment.
+		"""
+		if not self.journal or encoded not in self.last_hashes:
+			return False
+		since = self.last_started.get(self.last_generations.get(encoded, 0), 0)
+		return self.journal.is_unchanged(path, since)
+
+	@staticmethod
+	def build_manifest(directory: str, digest: Callable[[str], str], threads: int = 0) -> Tuple[str, Dict[str, Dict[str, str]]]:
+		"""
+		Canonical directory digest does not depend on filesystem: entries
+		are sorted by NFC-normalized names, and every record includes
+		entry type, name and size, so renames and moved contents are
+		detected. Manifest paths are always separated with slashes.
+		"""
+		files: Dict[str, str] = dict()
+		directories: Dict[str, str] = dict()
+		paths: List[str] = list()
+		tree: List[Tuple[str, List[Tuple[str, str, int]]]] = list()
+
+		# Collect structure first, files will be digested concurrently.
+		def walk(path: str, relative_path: str) -> None:
+			with os.scandir(path) as it:
+				entries = sorted(
+					((unicodedata.normalize("NFC", entry.name), entry) for entry in it),
+					key=lambda pair: pair[0]
+				)
+			children = list()
+			for name, entry in entries:
+				relative_entry = relative_path + "/" + name if relative_path else name
+				if entry.is_dir(follow_symlinks=False):
+					walk(entry.path, relative_entry)
+					children.append((name, relative_entry, -1))
+				elif entry.is_symlink() and entry.is_dir():
+					# Linked directories are not traversed, same as os.walk does.
+					continue
+				else:
+					paths.append(entry.path)
+					files[relative_entry] = ""
+					children.append((name, relative_entry, entry.stat().st_size))
+			tree.append((relative_path, children))
+
+		walk(directory, "")
+		for relative_file, hash in zip(files, digest_concurrently(paths, digest, threads)):
+			files[relative_file] = hash
+
+		# Subtrees are appended after their children, so fold them in order.
+		for relative_path, children in tree:
+			total = encode()
+			for name, relative_entry, size in children:
+				if size < 0:
+					record = "d\0" + name + "\0" + directories[relative_entry]
+				else:
+					record = "f\0" + name + "\0" + str(size) + "\0" + files[relative_entry]
+				total.update(bytes(record + "\n", "utf-8"))
+			directories[relative_path] = total.hexdigest()
+
+		return directories.pop(""), {
+			"files": files,
+			"directories": directories
+		}
+
 	@staticmethod
 	def do_comparing(path: str, /, comparing_mode: str = "content") -> bytes:
 		return bytes(str(getsize(path)), "utf-8") if comparing_mode == "size" \
@@ -58,32 +358,190 @@ class HashStorage:
 
 	@staticmethod
 	def get_directory_hash(directory: str, /, comparing_mode: str = "content") -> str:
-		total = encode()
-		for dirpath, dirnames, filenames in os.walk(directory):
-			for filename in filenames:
-				filepath = join(dirpath, filename)
-				total.update(HashStorage.do_comparing(filepath, comparing_mode=comparing_mode))
-		return total.hexdigest()
+		return HashStorage.build_manifest(directory, lambda path: HashStorage.get_file_hash(path, comparing_mode=comparing_mode))[0]
 
 	@staticmethod
 	def get_file_hash(path: str, /, comparing_mode: str = "content") -> str:
-		return encode(HashStorage.do_comparing(path, comparing_mode=comparing_mode)).hexdigest()
+		if comparing_mode != "content":
+			return encode(HashStorage.do_comparing(path, comparing_mode=comparing_mode)).hexdigest()
+		# Stream contents, shared objects and archives might be pretty large.
+		total = encode()
+		with open(path, "rb") as file:
+			while True:
+				chunk = file.read(CHUNK_SIZE)
+				if not chunk:
+					break
+				total.update(chunk)
+		return total.hexdigest()
 
 	def get_modified_files(self, path: str, extensions: Collection[str] = (), force: bool = False) -> List[str]:
+		"""
+		Returns added or changed files since last build, comparing
+		directory manifest with previously saved one.
+		"""
 		if not isdir(path):
 			raise NotADirectoryError(path)
-		return list(filter(
-			lambda filepath: self.is_path_changed(filepath, force),
-			get_all_files(path, extensions)
-		))
+		encoded = encode(bytes(path, "utf-8")).hexdigest()
+		manifest = self.get_directory_manifest(path, force)[1]
+		last_manifest = self.last_manifests.get(encoded)
+		last_files = last_manifest.get("files", dict()) if isinstance(last_manifest, dict) else dict()
+		extensions = tuple(extensions)
+		return [
+			normpath(join(path, relative_file)) for relative_file, hash in manifest["files"].items() \
+				if (len(extensions) == 0 or relative_file.endswith(extensions)) and last_files.get(relative_file) != hash
+		]
+
+	def get_modified_entries(self, path: str, force: bool = False) -> List[str]:
+		"""
+		Returns names of immediate directory entries which were added
+		or changed since last build, including subtrees with removals.
+		"""
+		if not isdir(path):
+			raise NotADirectoryError(path)
+		encoded = encode(bytes(path, "utf-8")).hexdigest()
+		manifest = self.get_directory_manifest(path, force)[1]
+		last_manifest = self.last_manifests.get(encoded)
+		if not isinstance(last_manifest, dict):
+			last_manifest = dict()
+		entries = list()
+		for section in ("files", "directories"):
+			last_entries = last_manifest.get(section, dict())
+			for relative_entry, hash in manifest[section].items():
+				if "/" not in relative_entry and last_entries.get(relative_entry) != hash:
+					entries.append(relative_entry)
+		return entries
 
 	def save(self) -> None:
-		os.makedirs(dirname(self.path), exist_ok=True)
-		with open(self.path, "w") as file:
-			json.dump({
-				**self.last_hashes,
-				**self.hashes
-			}, file, indent=None, separators=(",", ":"), ensure_ascii=False)
+		"""
+		Marks computed digests to be persisted, storage is flushed
+		once when task is completed.
+		"""
+		self.pending = True
+
+	def flush(self) -> None:
+		"""
+		Writes digests changed since last flush in single transaction,
+		unchanged entries are never rewritten.
+		"""
+		if not self.pending:
+			return
+		connection = self.connect()
+		if not connection:
+			return
+		try:
+			with connection:
+				connection.executemany(
+					"INSERT OR REPLACE INTO hashes (key, hash) VALUES (?, ?)",
+					((bytes.fromhex(key), bytes.fromhex(hash)) for key, hash in HashStorage.iterate_changes(self.hashes, self.saved_hashes, self.last_hashes))
+				)
+				connection.executemany(
+					"INSERT OR REPLACE INTO stats (key, inode, size, mtime, hash) VALUES (?, ?, ?, ?, ?)",
+					((bytes.fromhex(key), stat[0], stat[1], stat[2], bytes.fromhex(stat[3])) for key, stat in HashStorage.iterate_changes(self.stats, self.saved_stats, self.last_stats))
+				)
+				for key, manifest in HashStorage.iterate_changes(self.manifests, self.saved_manifests, self.last_manifests):
+					directory = bytes.fromhex(key)
+					previous = self.saved_manifests.get(key) or self.last_manifests.get(key) or dict()
+					for kind, section in enumerate(MANIFEST_SECTIONS):
+						entries = manifest[section]
+						previous_entries = previous.get(section, dict())
+						connection.executemany(
+							"DELETE FROM manifests WHERE directory = ? AND kind = ? AND path = ?",
+							((directory, kind, path) for path in previous_entries if path not in entries)
+						)
+						connection.executemany(
+							"INSERT OR REPLACE INTO manifests (directory, kind, path, hash) VALUES (?, ?, ?, ?)",
+							((directory, kind, path, bytes.fromhex(hash)) for path, hash in HashStorage.iterate_changes(entries, previous_entries))
+						)
+				self.touch_generations(connection)
+				self.collect_generations(connection)
+		except sqlite3.OperationalError as exc:
+			raise self.get_lock_error(exc)
+		finally:
+			connection.close()
+		self.saved_hashes.update(self.hashes)
+		self.saved_stats.update(self.stats)
+		self.saved_manifests.update(self.manifests)
+		self.pending = False
+
+	def touch_generations(self, connection: sqlite3.Connection) -> None:
+		"""
+		Records current generation for every entry used during this
+		build; entries are refreshed only after half of allowed
+		generations passed, so frequently used ones are not rewritten.
+		"""
+		refresh_generation = self.generation - max(1, self.max_generations // 2)
+		touched = list()
+		for values in (self.hashes, self.stats, self.manifests):
+			for key in values:
+				if key not in self.last_generations or self.last_generations[key] <= refresh_generation:
+					self.last_generations[key] = self.generation
+					touched.append(key)
+		connection.executemany(
+			"INSERT OR REPLACE INTO generations (key, generation) VALUES (?, ?)",
+			((bytes.fromhex(key), self.generation) for key in touched)
+		)
+		connection.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES ('generation', ?)", (self.generation, ))
+		# Digests were computed after storage was read, journal changes are compared with this moment.
+		if self.generation not in self.last_started:
+			self.last_started[self.generation] = self.started
+			connection.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", (f"started.{self.generation}", self.started))
+
+	def collect_generations(self, connection: sqlite3.Connection, max_generations: Optional[int] = None, max_entries: Optional[int] = None) -> int:
+		"""
+		Evicts entries which were not used in last generations or
+		oldest ones when storage exceeds entries limit.
+		"""
+		if max_generations is None:
+			max_generations = self.max_generations
+		if max_entries is None:
+			max_entries = self.max_entries
+		stale_generation = self.generation - max_generations if max_generations > 0 else 0
+		for generation in [generation for generation in self.last_started if generation < stale_generation]:
+			connection.execute("DELETE FROM metadata WHERE name = ?", (f"started.{generation}", ))
+			del self.last_started[generation]
+		evicted = [key for (key, ) in connection.execute("SELECT key FROM generations WHERE generation < ?", (stale_generation, ))]
+		if max_entries > 0:
+			(count, ) = connection.execute("SELECT COUNT(*) FROM generations").fetchone()
+			overflow = count - len(evicted) - max_entries
+			if overflow > 0:
+				evicted += [key for (key, ) in connection.execute("SELECT key FROM generations WHERE generation >= ? ORDER BY generation LIMIT ?", (stale_generation, overflow))]
+		if len(evicted) == 0:
+			return 0
+		for table, column in (("hashes", "key"), ("stats", "key"), ("manifests", "directory"), ("generations", "key")):
+			connection.executemany(f"DELETE FROM {table} WHERE {column} = ?", ((key, ) for key in evicted))
+		for key in evicted:
+			self.last_generations.pop(key.hex(), None)
+		return len(evicted)
+
+	def cleanup(self, max_generations: Optional[int] = None, max_entries: Optional[int] = None) -> int:
+		"""
+		Persists pending changes and evicts stale entries, returns
+		count of reclaimed entries.
+		"""
+		self.pending = True
+		self.flush()
+		connection = self.connect()
+		if not connection:
+			return 0
+		try:
+			with connection:
+				reclaimed = self.collect_generations(connection, max_generations, max_entries)
+			if reclaimed > 0:
+				connection.execute("VACUUM")
+		finally:
+			connection.close()
+		return reclaimed
+
+	@staticmethod
+	def iterate_changes(values: Dict[str, Any], *previous_values: Dict[str, Any]) -> Iterable[Tuple[str, Any]]:
+		for key, value in values.items():
+			for previous in previous_values:
+				if key in previous:
+					if previous[key] != value:
+						yield key, value
+					break
+			else:
+				yield key, value
 
 	def is_path_changed(self, path: str, force: bool = False) -> bool:
 		encoded = encode(bytes(path, "utf-8")).hexdigest()
@@ -3,14 +3,17 @@ import os
 import platform
 import re
 import subprocess
-from os.path import basename, isdir, isfile, join, normpath, relpath
-from typing import Any, Dict, Final, List
+from os.path import (basename, dirname, isabs, isdir, isfile, join, normpath,
+                     relpath, splitext)
+from typing import Any, Dict, Final, List, Optional
+from zipfile import ZIP_DEFLATED, BadZipFile, ZipFile
 
 from . import GLOBALS, PROPERTIES
+from .artifact_cache import ArtifactCache, encode, get_tool_identity
 from .hglob import glob
 from .shell import debug, error, info, warn
 from .utils import ensure_file_directory, request_typescript
-from .workspace import TSCONFIG
+from .workspace import TSCONFIG, WorkspaceComposite
 
 # Will be excluded with toolchain overriden options
 TSCONFIG_DEPENDENTS: Dict[str, Any] = {
@@ -191,17 +194,24 @@ class Includes:
 
 		from time import time
 		if GLOBALS.BUILD_STORAGE.is_path_changed(self.directory) or not isfile(temporary_path):
-			debug(f"Building {basename(target_path)!r} from {self.includes!r}")
+			modified_files = GLOBALS.BUILD_STORAGE.get_modified_files(self.directory)
+			debug(f"Building {basename(target_path)!r} from {self.includes!r} ({len(modified_files)} files changed)")
 
-			startup_millis = time()
-			overall_result = self.build_source(temporary_path, language)
-
-			startup_millis = time() - startup_millis
-			if overall_result == 0:
-				print(f"Completed {basename(target_path)!r} flushing in {startup_millis:.2f}s!")
+			artifact_key = self.get_artifact_key() if language.lower() == "typescript" else None
+			if artifact_key and Includes.restore_artifact(artifact_key, temporary_path):
+				print(f"Restored {basename(target_path)!r} from artifact cache.")
 			else:
-				error(f"Failed {basename(target_path)!r} flushing in {startup_millis:.2f}s with result {overall_result}.")
-				return overall_result
+				startup_millis = time()
+				overall_result = self.build_source(temporary_path, language)
+
+				startup_millis = time() - startup_millis
+				if overall_result == 0:
+					print(f"Completed {basename(target_path)!r} flushing in {startup_millis:.2f}s!")
+				else:
+					error(f"Failed {basename(target_path)!r} flushing in {startup_millis:.2f}s with result {overall_result}.")
+					return overall_result
+				if artifact_key:
+					Includes.store_artifact(artifact_key, temporary_path)
 
 			GLOBALS.BUILD_STORAGE.is_path_changed(self.directory, True)
 			GLOBALS.BUILD_STORAGE.save()
@@ -210,6 +220,83 @@ class Includes:
 
 		return overall_result
 
+	def get_artifact_key(self) -> Optional[str]:
+		"""
+		Keys compiled script by sources, declarations and options, which
+		do not depend on project location; sources including anything
+		outside of directory are never cached.
+		"""
+		if any(normpath(path).startswith("..") or isabs(path) for path in self.include):
+			return None
+		tsc = request_typescript(only_check=True)
+		if not tsc:
+			return None
+		options = dict()
+		for path in (GLOBALS.WORKSPACE_COMPOSITE.get_tsconfig(), self.get_tsconfig()):
+			try:
+				with open(path, encoding="utf-8") as tsconfig:
+					options.update(json.load(tsconfig).get("compilerOptions", dict()))
+			except (OSError, ValueError):
+				return None
+		options.pop("outFile", None)
+		options.pop("outDir", None)
+		flags = [
+			json.dumps(options, sort_keys=True),
+			json.dumps(sorted(self.exclude)),
+			"release" if PROPERTIES.get_value("release") else "debug",
+			*GLOBALS.PREFERRED_CONFIG.get_value("development.tsc", list())
+		]
+		flags += sorted(GLOBALS.BUILD_STORAGE.get_path_hash(declaration) for declaration in WorkspaceComposite.resolve_declarations())
+		sources = GLOBALS.BUILD_STORAGE.get_directory_manifest(self.directory)[1]["files"]
+		digest = encode()
+		for path, hash in sorted(sources.items()):
+			# Generated configuration refers to project location.
+			if path != "tsconfig.json":
+				digest.update(bytes(path + "\0" + hash + "\n", "utf-8"))
+		return ArtifactCache.get_key("tsc-outputs", get_tool_identity([tsc]), flags, digest.hexdigest())
+
+	@staticmethod
+	def get_emitted_files(temporary_path: str) -> List[str]:
+		"""
+		Files which tsc might emit beside script, declarations and build
+		info are used by referencing and incremental compilations.
+		"""
+		name = splitext(temporary_path)[0]
+		return [temporary_path, temporary_path + ".map", name + ".d.ts", name + ".d.ts.map", name + ".tsbuildinfo"]
+
+	@staticmethod
+	def restore_artifact(artifact_key: str, temporary_path: str) -> bool:
+		"""
+		Replaces every emitted file with ones from artifact, so outputs
+		of previous compilation would never be mixed with restored ones.
+		"""
+		compressed_outputs = temporary_path + ".outputs.zip"
+		if not GLOBALS.ARTIFACT_CACHE.fetch(artifact_key, compressed_outputs):
+			return False
+		try:
+			with ZipFile(compressed_outputs) as archive:
+				if basename(temporary_path) not in archive.namelist():
+					return False
+				for path in Includes.get_emitted_files(temporary_path):
+					if isfile(path):
+						os.remove(path)
+				archive.extractall(dirname(temporary_path))
+			return True
+		except (OSError, BadZipFile):
+			return False
+		finally:
+			os.remove(compressed_outputs)
+
+	@staticmethod
+	def store_artifact(artifact_key: str, temporary_path: str) -> None:
+		compressed_outputs = temporary_path + ".outputs.zip"
+		with ZipFile(compressed_outputs, "w", ZIP_DEFLATED) as archive:
+			for path in Includes.get_emitted_files(temporary_path):
+				if isfile(path):
+					archive.write(path, basename(path))
+		GLOBALS.ARTIFACT_CACHE.store(artifact_key, compressed_outputs)
+		os.remove(compressed_outputs)
+
 	def build_source(self, temporary_path: str, language: str = "typescript") -> int:
 		ensure_file_directory(temporary_path)
 
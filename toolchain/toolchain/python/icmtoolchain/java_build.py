@@ -3,20 +3,23 @@ import os
 import platform
 import re
 import subprocess
+import threading
 from collections import namedtuple
 from os.path import basename, exists, isdir, isfile, join, relpath, splitext
-from typing import Collection, Dict, List, Optional
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Tuple
 from zipfile import ZipFile
 
 from . import GLOBALS, PROPERTIES
+from .artifact_cache import ArtifactCache
 from .base_config import BaseConfig
 from .component import install_components
+from .jobs import JobScheduler
 from .language import get_language_directories
 from .shell import abort, debug, error, info, warn
 from .utils import (RuntimeCodeError, copy_directory, copy_file,
-                    ensure_directory, ensure_file, get_all_files,
-                    get_next_filename, remove_tree, request_executable_version,
-                    request_tool, walk_all_files)
+                    ensure_directory, ensure_file, ensure_file_directory,
+                    get_all_files, get_next_filename, remove_tree,
+                    request_executable_version, request_tool, walk_all_files)
 
 BuildTarget = namedtuple("BuildTarget", "directory relative_directory output_directory manifest classpath")
 
@@ -54,26 +57,83 @@ def flatten_classpath_files(targets: Collection[BuildTarget]) -> List[str]:
 		library for target in targets for library in target.classpath
 	]
 
-def rebuild_library_cache(relative_directory: str, libraries: Collection[str], target_directory: str) -> List[str]:
-	target_classes_directory = join(target_directory, "libraries", "classes", relative_directory)
-	compressed_libraries = join(target_directory, "libraries", relative_directory + ".zip")
-
-	debug(f"Rebuilding library cache: {relative_directory}")
-	remove_tree(target_classes_directory)
-	ensure_directory(target_classes_directory)
-
-	import shutil
-	for filename in libraries:
-		debug(f"Extracting library classes: {basename(filename)}")
-		shutil.unpack_archive(filename, target_classes_directory, "zip")
-
-	debug("Zipping extracted cache")
-	remove_tree(compressed_libraries)
-	shutil.make_archive(compressed_libraries[:-4], "zip", target_classes_directory)
-	return [compressed_libraries]
+class TargetLog:
+	"""
+	Messages of target built in worker thread, which are printed at once
+	after target is done, so logs of concurrent targets are not mixed.
+	"""
+	messages: List[Tuple[Callable[[str], None], str]]
+
+	def __init__(self) -> None:
+		self.messages = list()
+
+	def report(self, function: Callable[[str], None], message: str) -> None:
+		self.messages.append((function, message))
+
+	def flush(self) -> None:
+		for function, message in self.messages:
+			function(message)
+		self.messages.clear()
+
+def build_java_targets(targets: Collection[BuildTarget], build: Callable[[BuildTarget, TargetLog], int]) -> int:
+	"""
+	Builds independent targets concurrently, logs are printed in order
+	of targets; once any target is failed, pending ones are skipped.
+	"""
+	if len(targets) == 0:
+		return 0
+	with JobScheduler(GLOBALS.PREFERRED_CONFIG.get_value("java.jobs")) as scheduler:
+		def build_target(target: BuildTarget, log: TargetLog) -> int:
+			return build(target, log) if not scheduler.cancelled else 0
+		jobs = list()
+		for target in targets:
+			log = TargetLog()
+			jobs.append((log, scheduler.submit(build_target, target, log)))
+		overall_result = 0
+		for log, job in jobs:
+			result = job.result()
+			log.flush()
+			if result != 0 and overall_result == 0:
+				overall_result = result
+				scheduler.cancel()
+	return overall_result
 
-def update_modified_targets(targets: Collection[BuildTarget], target_directory: str) -> Dict[str, Dict[str, List[str]]]:
+def read_library_record(path: str) -> Dict[str, str]:
+	try:
+		with open(path, encoding="utf-8") as file:
+			record = json.load(file)
+		return {
+			str(library): str(digest) for library, digest in record["libraries"].items()
+		}
+	except (OSError, ValueError, KeyError, TypeError, AttributeError):
+		return dict()
+
+def get_modified_libraries(relative_directory: str, libraries: Collection[str], target_directory: str) -> Tuple[List[str], Dict[str, str]]:
+	"""
+	Compares digests of libraries with recorded ones, returns added,
+	changed and removed libraries together with current digests, which
+	are recorded only after target was successfully dexed.
+	"""
+	recorded_digests = read_library_record(join(target_directory, "libraries", relative_directory + ".json"))
+	digests = {
+		filename: GLOBALS.BUILD_STORAGE.get_path_hash(filename) for filename in libraries
+	}
+	return sorted(
+		filename for filename in set(digests) | set(recorded_digests) if digests.get(filename) != recorded_digests.get(filename)
+	), digests
+
+def write_library_record(relative_directory: str, digests: Dict[str, str], target_directory: str) -> None:
+	record_path = join(target_directory, "libraries", relative_directory + ".json")
+	# Classes were extracted and zipped by previous toolchain versions.
+	remove_tree(join(target_directory, "libraries", "classes", relative_directory))
+	remove_tree(join(target_directory, "libraries", relative_directory + ".zip"))
+	ensure_file_directory(record_path)
+	with open(record_path, "w", encoding="utf-8") as file:
+		json.dump({ "libraries": digests }, file, indent="\t", sort_keys=True)
+
+def update_modified_targets(targets: Collection[BuildTarget], target_directory: str) -> Tuple[Dict[str, Dict[str, List[str]]], Dict[str, Dict[str, str]]]:
 	modified_files = dict()
+	library_digests = dict()
 
 	for target in targets:
 		classes_directory = join(target_directory, "classes", target.relative_directory, "classes")
@@ -83,19 +143,19 @@ def update_modified_targets(targets: Collection[BuildTarget], target_directory:
 		for library_path in target.manifest.get_value("library-dirs", list()):
 			library_directory = join(target.directory, library_path)
 			if exists(library_directory) and isdir(library_directory):
-				libraries.extend(GLOBALS.BUILD_STORAGE.get_modified_files(library_directory, (".jar")))
+				libraries.extend(get_all_files(library_directory, (".jar")))
 			else:
 				warn(f"* Directory {library_path!r} could not be found, please check your 'manifest' file!")
 
-		if len(libraries) > 0:
-			libraries = rebuild_library_cache(target.relative_directory, libraries, target_directory)
+		# Unchanged libraries are recognized by their digests.
+		libraries, library_digests[target.relative_directory] = get_modified_libraries(target.relative_directory, libraries, target_directory)
 		if len(classes) > 0 or len(libraries) > 0:
 			modified_files[target.relative_directory] = {
 				"classes": classes,
 				"libraries": libraries
 			}
 
-	return modified_files
+	return modified_files, library_digests
 
 def copy_additional_sources(targets: Collection[BuildTarget]) -> None:
 	for target in targets:
@@ -120,7 +180,7 @@ def copy_additional_sources(targets: Collection[BuildTarget]) -> None:
 
 ### D8/L8/R8
 
-def run_d8(target: BuildTarget, modified_pathes: Dict[str, List[str]], classpath: Collection[str], target_directory: str) -> int:
+def run_d8(target: BuildTarget, modified_pathes: Dict[str, List[str]], classpath: Collection[str], target_directory: str, log: TargetLog) -> int:
 	java_executable = request_tool("java")
 	if not java_executable:
 		abort("Executable 'java' is required for compilation, nothing to do.")
@@ -139,36 +199,17 @@ def run_d8(target: BuildTarget, modified_pathes: Dict[str, List[str]], classpath
 	compressed_target = target_d8_directory + ".zip"
 	ensure_directory(target_d8_directory)
 
+	# Libraries were dexed into this directory by previous toolchain versions.
+	for filename in os.listdir(target_d8_directory):
+		if filename.startswith("classes") and filename.endswith(".dex"):
+			os.remove(join(target_d8_directory, filename))
 	modified_class_pathes = modified_pathes["classes"]
 	modified_classes = join(target_d8_directory, "modified_classes.rsp")
 	with open(modified_classes, "w", encoding="utf-8") as modified:
 		modified.writelines(path + "\n" for path in modified_class_pathes)
-	modified_library_pathes = modified_pathes["libraries"]
-	modified_libraries = join(target_d8_directory, "modified_libraries.rsp")
-	with open(modified_libraries, "w", encoding="utf-8") as modified:
-		modified.writelines(path + "\n" for path in modified_library_pathes)
-
-	debug("Dexing libraries")
-	result = subprocess.run([
-		java_executable,
-		"-classpath", GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/r8/r8.jar"),
-		"com.android.tools.r8.D8",
-		f"@{modified_libraries}"
-	] + classpath_targets + libraries + [
-		"--min-api", "19",
-		"--release" if PROPERTIES.get_value("release") else "--debug",
-		"--intermediate",
-		"--output", target_d8_directory
-	], text=True, capture_output=True)
-	if result.returncode != 0:
-		error(result.stderr.strip())
-		return result.returncode
 
-	debug("Dexing classes")
-	result = subprocess.run([
-		java_executable,
-		"-classpath", GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/r8/r8.jar"),
-		"com.android.tools.r8.D8",
+	log.report(debug, "Dexing classes")
+	result, output = GLOBALS.D8_WORKER.run(java_executable, [
 		f"@{modified_classes}"
 	] + classpath_targets + libraries + [
 		"--min-api", "19",
@@ -176,18 +217,136 @@ def run_d8(target: BuildTarget, modified_pathes: Dict[str, List[str]], classpath
 		"--intermediate",
 		"--file-per-class",
 		"--output", target_d8_directory
-	], text=True, capture_output=True)
-	if result.returncode != 0:
-		error(result.stderr.strip())
-		return result.returncode
+	], GLOBALS.PREFERRED_CONFIG.get_value("java.d8Worker", True))
+	if result != 0:
+		log.report(error, output.strip())
+		return result
 
-	debug("Compressing archives")
+	log.report(debug, "Compressing archives")
 	with ZipFile(compressed_target, "w") as archive:
 		walk_all_files(target_d8_directory, lambda filename: archive.write(filename, arcname=filename[len(target_d8_directory) + 1:]), (".dex"))
 
 	return 0
 
-def merge_compressed_dexes(target: BuildTarget, target_directory: str) -> int:
+def get_d8_library_keys(target: BuildTarget) -> Dict[str, str]:
+	"""
+	Keys intermediate dex of every library by its own digest, so dexed
+	jar is reused by another targets, builds and projects.
+	"""
+	flags = ["--min-api", "19", "--release" if PROPERTIES.get_value("release") else "--debug"]
+	version = GLOBALS.BUILD_STORAGE.get_path_hash(GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/r8/r8.jar"))
+	keys = dict()
+	for library_path in target.manifest.get_value("library-dirs", list()):
+		library_directory = join(target.directory, library_path)
+		if isdir(library_directory):
+			for filename in get_all_files(library_directory, (".jar")):
+				keys[filename] = ArtifactCache.get_key("d8-library", version, flags, GLOBALS.BUILD_STORAGE.get_path_hash(filename))
+	return keys
+
+def cleanup_library_dexes(library_keys: Iterable[str], target_directory: str) -> None:
+	"""
+	Removes dexed libraries which are not used by any target anymore,
+	they are still kept by artifact cache.
+	"""
+	libraries_d8_directory = join(target_directory, "libraries", "dex")
+	if not isdir(libraries_d8_directory):
+		return
+	filenames = set(key + ".zip" for key in library_keys)
+	for filename in os.listdir(libraries_d8_directory):
+		if filename not in filenames:
+			remove_tree(join(libraries_d8_directory, filename))
+
+def dex_java_libraries(target: BuildTarget, library_keys: Dict[str, str], target_directory: str, log: TargetLog) -> Tuple[int, List[str]]:
+	"""
+	Dexes every library into separate intermediate archive, which are
+	restored from artifact cache or kept from previous builds whenever
+	possible. Returns result code and archives which should be merged.
+	"""
+	java_executable = request_tool("java")
+	if not java_executable:
+		abort("Executable 'java' is required for compilation, nothing to do.")
+
+	libraries_d8_directory = join(target_directory, "libraries", "dex")
+	ensure_directory(libraries_d8_directory)
+	compressed_libraries = list()
+	for filename, key in library_keys.items():
+		compressed_library = join(libraries_d8_directory, key + ".zip")
+		compressed_libraries.append(compressed_library)
+		if isfile(compressed_library) or GLOBALS.ARTIFACT_CACHE.fetch(key, compressed_library):
+			continue
+		log.report(debug, f"Dexing library {basename(filename)}")
+		classpath = list()
+		for library in (*target.classpath, *library_keys):
+			if library != filename:
+				classpath += ["--classpath", library]
+		# Same library may be dexed by another target simultaneously.
+		temporary_library = f"{compressed_library[:-4]}.{os.getpid()}.{threading.get_ident()}.zip"
+		result, output = GLOBALS.D8_WORKER.run(java_executable, [
+			filename
+		] + classpath + [
+			"--min-api", "19",
+			"--release" if PROPERTIES.get_value("release") else "--debug",
+			"--intermediate",
+			"--output", temporary_library
+		], GLOBALS.PREFERRED_CONFIG.get_value("java.d8Worker", True))
+		if result != 0:
+			if isfile(temporary_library):
+				os.remove(temporary_library)
+			log.report(error, output.strip())
+			return result, compressed_libraries
+		os.replace(temporary_library, compressed_library)
+		GLOBALS.ARTIFACT_CACHE.store(key, compressed_library)
+	return 0, compressed_libraries
+
+def get_d8_artifact_key(target: BuildTarget, target_directory: str) -> str:
+	"""
+	Keys dexes of target by compiled classes, libraries and classpath,
+	intermediate archive describes d8 state of target classes.
+	"""
+	flags = ["--min-api", "19", "--release" if PROPERTIES.get_value("release") else "--debug"]
+	flags += (GLOBALS.BUILD_STORAGE.get_path_hash(filename) for filename in target.classpath if isfile(filename))
+	for library_path in target.manifest.get_value("library-dirs", list()):
+		library_directory = join(target.directory, library_path)
+		if isdir(library_directory):
+			flags.append(GLOBALS.BUILD_STORAGE.get_path_hash(library_directory))
+	classes_directory = join(target_directory, "classes", target.relative_directory, "classes")
+	return ArtifactCache.get_key(
+		"d8-classes", GLOBALS.BUILD_STORAGE.get_path_hash(GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/r8/r8.jar")), flags,
+		GLOBALS.BUILD_STORAGE.get_path_hash(classes_directory) if isdir(classes_directory) else ""
+	)
+
+def restore_d8_artifact(target: BuildTarget, artifact_key: str, target_directory: str) -> bool:
+	target_d8_directory = join(target_directory, "d8", target.relative_directory)
+	compressed_target = target_d8_directory + ".zip"
+	if not GLOBALS.ARTIFACT_CACHE.fetch(artifact_key, compressed_target):
+		return False
+	# Following incremental builds dex only modified classes over restored ones.
+	remove_tree(target_d8_directory)
+	ensure_directory(target_d8_directory)
+	with ZipFile(compressed_target) as archive:
+		archive.extractall(target_d8_directory)
+	return True
+
+def dex_java_target(target: BuildTarget, modified_pathes: Dict[str, List[str]], artifact_key: str, library_keys: Dict[str, str], target_directory: str, log: TargetLog) -> int:
+	result, compressed_libraries = dex_java_libraries(target, library_keys, target_directory, log)
+	if result != 0:
+		log.report(error, f"Failed to dex libraries of {target.relative_directory!r} with result {result}.")
+		return result
+	if restore_d8_artifact(target, artifact_key, target_directory):
+		log.report(info, f"* Restored dexes of {target.relative_directory!r} from artifact cache")
+	else:
+		log.report(info, f"* Running d8 with {target.relative_directory!r}")
+		result = run_d8(target, modified_pathes, target.classpath, target_directory, log)
+		if result != 0:
+			log.report(error, f"Failed to dex {target.relative_directory!r} with result {result}.")
+			return result
+		GLOBALS.ARTIFACT_CACHE.store(artifact_key, join(target_directory, "d8", target.relative_directory + ".zip"))
+	result = merge_compressed_dexes(target, compressed_libraries, target_directory, log)
+	if result != 0:
+		log.report(error, f"Failed to merge {target.relative_directory!r} with result {result}.")
+	return result
+
+def merge_compressed_dexes(target: BuildTarget, compressed_libraries: Collection[str], target_directory: str, log: TargetLog) -> int:
 	compressed_target = join(target_directory, "d8", target.relative_directory + ".zip")
 	output_directory = join(target_directory, "odex", target.relative_directory)
 	remove_tree(output_directory)
@@ -197,20 +356,18 @@ def merge_compressed_dexes(target: BuildTarget, target_directory: str) -> int:
 	if not java_executable:
 		abort("Executable 'java' is required for compilation, nothing to do.")
 
-	debug("Merging dex")
-	result = subprocess.run([
-		java_executable,
-		"-classpath", GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/r8/r8.jar"),
-		"com.android.tools.r8.D8",
+	log.report(debug, "Merging dex")
+	result, output = GLOBALS.D8_WORKER.run(java_executable, [
 		compressed_target,
+		*compressed_libraries,
 		"--min-api", "19",
 		"--release" if PROPERTIES.get_value("release") else "--debug",
 		"--intermediate",
 		"--output", output_directory
-	], text=True, capture_output=True)
-	if result.returncode != 0:
-		error(result.stderr.strip())
-		return result.returncode
+	], GLOBALS.PREFERRED_CONFIG.get_value("java.d8Worker", True))
+	if result != 0:
+		log.report(error, output.strip())
+		return result
 
 	return 0
 
@@ -219,6 +376,7 @@ def merge_compressed_dexes(target: BuildTarget, target_directory: str) -> int:
 def build_java_with_javac(targets: Collection[BuildTarget], target_directory: str) -> int:
 	javac_executable = None
 	supports_modules = False
+	changed_targets = list()
 
 	for target in targets:
 		source_directories = target.manifest.get_value("source-dirs", list())
@@ -226,8 +384,6 @@ def build_java_with_javac(targets: Collection[BuildTarget], target_directory: st
 		if len(source_directories) == 0 and len(library_directories) == 0:
 			continue
 
-		from time import time
-		startup_millis = time()
 		target_compiler_directory = join(target_directory, "classes", target.relative_directory)
 		target_classes_directory = join(target_compiler_directory, "classes")
 		ensure_directory(target_classes_directory)
@@ -240,6 +396,7 @@ def build_java_with_javac(targets: Collection[BuildTarget], target_directory: st
 		if not write_changed_source_files(target, source_directories, classes_listing):
 			info(f"* Directory {target.relative_directory!r} is not changed.")
 			continue
+		changed_targets.append(target)
 
 		if not javac_executable:
 			javac_executable = request_tool("javac")
@@ -248,45 +405,58 @@ def build_java_with_javac(targets: Collection[BuildTarget], target_directory: st
 			supports_modules = request_executable_version(javac_executable)
 			supports_modules = supports_modules >= 1.9 or supports_modules >= 9
 
-		options = target.manifest.get_value("options", list())
-		if supports_modules:
-			options += ["--release", "8"]
-		else:
-			options += [
-				"-source", "8",
-				"-target", "8"
-			]
-		if target.manifest.get_value("verbose", False):
-			options.append("-verbose")
-		if len(source_directories) > 0:
-			options += ["-sourcepath", os.pathsep.join(join(target.directory, source) for source in source_directories)]
-		precompiled = list()
-		if supports_modules:
-			precompiled += target.classpath
-		else:
-			# Might be unstable with lambdas, desugaring requires JDK >= 9.
-			options += ["-bootclasspath", os.pathsep.join(target.classpath)]
-		if len(library_directories) > 0:
-			precompiled += get_all_files((join(target.directory, library) for library in library_directories), (".jar"))
-		options += ["-classpath", os.pathsep.join(precompiled)]
+	return build_java_targets(changed_targets, lambda target, log: compile_java_target_with_javac(target, target_directory, javac_executable, supports_modules, log))
 
-		result = subprocess.run([
-			javac_executable
-		] + options + [
-			"-Xlint",
-			"-Xlint:-cast",
-			"-implicit:class",
-			"-d", target_classes_directory,
-			"-s", target_sources_directory,
-			"-h", target_headers_directory,
-			f"@{classes_listing}"
-		], text=True, capture_output=True)
-		startup_millis = time() - startup_millis
-		if result.returncode != 0:
-			error(result.stderr.strip())
-			error(f"Failed {target.relative_directory!r} compilation in {startup_millis:.2f}s with result {result.returncode}.")
-			return result.returncode
-		debug(f"Completed {target.relative_directory!r} compilation in {startup_millis:.2f}s!")
+def compile_java_target_with_javac(target: BuildTarget, target_directory: str, javac_executable: str, supports_modules: bool, log: TargetLog) -> int:
+	from time import time
+	startup_millis = time()
+	source_directories = target.manifest.get_value("source-dirs", list())
+	library_directories = target.manifest.get_value("library-dirs", list())
+	target_compiler_directory = join(target_directory, "classes", target.relative_directory)
+	target_classes_directory = join(target_compiler_directory, "classes")
+	target_sources_directory = join(target_compiler_directory, "generated", "sources", "annotationProcessor")
+	target_headers_directory = join(target_compiler_directory, "generated", "sources", "headers")
+	classes_listing = join(target_compiler_directory, ".classes")
+
+	options = target.manifest.get_value("options", list())
+	if supports_modules:
+		options += ["--release", "8"]
+	else:
+		options += [
+			"-source", "8",
+			"-target", "8"
+		]
+	if target.manifest.get_value("verbose", False):
+		options.append("-verbose")
+	if len(source_directories) > 0:
+		options += ["-sourcepath", os.pathsep.join(join(target.directory, source) for source in source_directories)]
+	precompiled = list()
+	if supports_modules:
+		precompiled += target.classpath
+	else:
+		# Might be unstable with lambdas, desugaring requires JDK >= 9.
+		options += ["-bootclasspath", os.pathsep.join(target.classpath)]
+	if len(library_directories) > 0:
+		precompiled += get_all_files((join(target.directory, library) for library in library_directories), (".jar"))
+	options += ["-classpath", os.pathsep.join(precompiled)]
+
+	result = subprocess.run([
+		javac_executable
+	] + options + [
+		"-Xlint",
+		"-Xlint:-cast",
+		"-implicit:class",
+		"-d", target_classes_directory,
+		"-s", target_sources_directory,
+		"-h", target_headers_directory,
+		f"@{classes_listing}"
+	], text=True, capture_output=True)
+	startup_millis = time() - startup_millis
+	if result.returncode != 0:
+		log.report(error, result.stderr.strip())
+		log.report(error, f"Failed {target.relative_directory!r} compilation in {startup_millis:.2f}s with result {result.returncode}.")
+		return result.returncode
+	log.report(debug, f"Completed {target.relative_directory!r} compilation in {startup_millis:.2f}s!")
 	return 0
 
 def write_changed_source_files(target: BuildTarget, directories: Collection[str], filename: str) -> bool:
@@ -305,7 +475,8 @@ def write_changed_source_files(target: BuildTarget, directories: Collection[str]
 ### ECJ
 
 def build_java_with_ecj(targets: Collection[BuildTarget], target_directory: str) -> int:
-	ecj_executable = None
+	ecj_executable = list()
+	changed_targets = list()
 
 	for target in targets:
 		source_directories = target.manifest.get_value("source-dirs", list())
@@ -313,8 +484,6 @@ def build_java_with_ecj(targets: Collection[BuildTarget], target_directory: str)
 		if len(source_directories) == 0 and len(library_directories) == 0:
 			continue
 
-		from time import time
-		startup_millis = time()
 		target_compiler_directory = join(target_directory, "classes", target.relative_directory)
 		target_classes_directory = join(target_compiler_directory, "classes")
 		ensure_directory(target_classes_directory)
@@ -325,6 +494,7 @@ def build_java_with_ecj(targets: Collection[BuildTarget], target_directory: str)
 		if not write_changed_source_files(target, source_directories, classes_listing):
 			info(f"* Directory {target.relative_directory!r} is not changed.")
 			continue
+		changed_targets.append(target)
 
 		if not ecj_executable:
 			java_executable = request_tool("java")
@@ -334,41 +504,52 @@ def build_java_with_ecj(targets: Collection[BuildTarget], target_directory: str)
 			ecj_executables = GLOBALS.TOOLCHAIN_CONFIG.get_paths("toolchain/bin/*", lambda filename: isfile(filename) and re.fullmatch(ecj_pattern, basename(filename)) is not None)
 			if len(ecj_executables) == 0:
 				abort("Executable 'ecj-*.jar' is required for compilation, nothing to do.")
-			ecj_executable = list()
 			for executable in ecj_executables:
 				ecj_executable = [java_executable, "-jar", executable]
 				if request_executable_version(ecj_executable) != 0.0:
 					break
 			# TODO: error("Executable 'ecj-*.jar' is not supported, nothing to do.")
 
-		options = target.manifest.get_value("options", list())
-		if target.manifest.get_value("verbose", False):
-			options.append("-verbose")
-		if len(source_directories) > 0:
-			options += ["-sourcepath", ":".join(join(target.directory, source) for source in source_directories)]
-		precompiled = target.classpath
-		if len(library_directories) > 0:
-			precompiled += get_all_files((join(target.directory, library) for library in library_directories), (".jar"))
-		options += ["-classpath", ":".join(precompiled)]
-
-		result = subprocess.run(ecj_executable + [
-			"--release", "8",
-			"-Xlint",
-			"-Xlint:-cast",
-			"-Xemacs",
-			"-proceedOnError",
-			"-d", target_classes_directory,
-			"-s", target_sources_directory
-		] + options + [
-			f"@{classes_listing}"
-		], text=True, capture_output=True)
-		startup_millis = time() - startup_millis
-		if result.returncode == 0:
-			debug(f"Completed {target.relative_directory!r} compilation in {startup_millis:.2f}s!")
-		else:
-			error(result.stderr.strip())
-			error(f"Failed {target.relative_directory!r} compilation in {startup_millis:.2f}s with result {result.returncode}.")
-			return result.returncode
+	return build_java_targets(changed_targets, lambda target, log: compile_java_target_with_ecj(target, target_directory, ecj_executable, log))
+
+def compile_java_target_with_ecj(target: BuildTarget, target_directory: str, ecj_executable: List[str], log: TargetLog) -> int:
+	from time import time
+	startup_millis = time()
+	source_directories = target.manifest.get_value("source-dirs", list())
+	library_directories = target.manifest.get_value("library-dirs", list())
+	target_compiler_directory = join(target_directory, "classes", target.relative_directory)
+	target_classes_directory = join(target_compiler_directory, "classes")
+	target_sources_directory = join(target_compiler_directory, "generated", "sources")
+	classes_listing = join(target_compiler_directory, ".classes")
+
+	options = target.manifest.get_value("options", list())
+	if target.manifest.get_value("verbose", False):
+		options.append("-verbose")
+	if len(source_directories) > 0:
+		options += ["-sourcepath", ":".join(join(target.directory, source) for source in source_directories)]
+	precompiled = target.classpath
+	if len(library_directories) > 0:
+		precompiled += get_all_files((join(target.directory, library) for library in library_directories), (".jar"))
+	options += ["-classpath", ":".join(precompiled)]
+
+	result = subprocess.run(ecj_executable + [
+		"--release", "8",
+		"-Xlint",
+		"-Xlint:-cast",
+		"-Xemacs",
+		"-proceedOnError",
+		"-d", target_classes_directory,
+		"-s", target_sources_directory
+	] + options + [
+		f"@{classes_listing}"
+	], text=True, capture_output=True)
+	startup_millis = time() - startup_millis
+	if result.returncode == 0:
+		log.report(debug, f"Completed {target.relative_directory!r} compilation in {startup_millis:.2f}s!")
+	else:
+		log.report(error, result.stderr.strip())
+		log.report(error, f"Failed {target.relative_directory!r} compilation in {startup_millis:.2f}s with result {result.returncode}.")
+		return result.returncode
 	return 0
 
 ### GRADLE
@@ -385,6 +566,8 @@ def build_java_with_gradle(targets: Collection[BuildTarget], target_directory: s
 			if target.manifest.get_value("verbose", False):
 				options += ["--console", "verbose"]
 				break
+		if GLOBALS.MAKE_CONFIG.get_value("java.daemon", False):
+			options += ["--daemon", "--build-cache", "--parallel"]
 
 		result = subprocess.run([
 			gradle_executable,
@@ -403,14 +586,25 @@ def build_java_with_gradle(targets: Collection[BuildTarget], target_directory: s
 	cleanup_gradle_scripts(targets)
 	return result.returncode if len(targets) != 0 else 0
 
+def write_gradle_script(path: str, content: str) -> None:
+	"""
+	Scripts are rewritten only when their content changed, otherwise
+	Gradle would consider project configuration outdated.
+	"""
+	if isfile(path):
+		with open(path, encoding="utf-8", newline="") as script:
+			if script.read() == content:
+				return
+	with open(path, "w", encoding="utf-8", newline="") as script:
+		script.write(content)
+
 def setup_gradle_project(targets: Collection[BuildTarget], target_directory: str, classpath: Collection[str]) -> None:
-	with open(join(target_directory, "settings.gradle"), "w", encoding="utf-8") as settings_gradle:
-		for target in targets:
-			settings_gradle.write(f'include ":{target.relative_directory}"')
-			settings_gradle.write(os.linesep)
-			project_directory = target.directory.replace("\\", "\\\\")
-			settings_gradle.write(f'project(":{target.relative_directory}").projectDir = file("{project_directory}")')
-			settings_gradle.write(os.linesep)
+	settings_gradle = ""
+	for target in targets:
+		settings_gradle += f'include ":{target.relative_directory}"' + os.linesep
+		project_directory = target.directory.replace("\\", "\\\\")
+		settings_gradle += f'project(":{target.relative_directory}").projectDir = file("{project_directory}")' + os.linesep
+	write_gradle_script(join(target_directory, "settings.gradle"), settings_gradle)
 
 	target_classes_directory = join(target_directory, "classes")
 	ensure_directory(target_classes_directory)
@@ -421,8 +615,7 @@ def setup_gradle_project(targets: Collection[BuildTarget], target_directory: str
 			write_build_gradle(target.directory, classpath, target_classes_directory, source_directories, library_directories)
 
 def write_build_gradle(directory: str, classpath: Collection[str], target_classes_directory: str, source_directories: Collection[str], library_directories: Collection[str]) -> None:
-	with open(join(directory, "build.gradle"), "w", encoding="utf-8") as build_gradle:
-		build_gradle.write(
+	write_gradle_script(join(directory, "build.gradle"),
 """plugins {
 	id "com.github.johnrengelman.shadow" version "5.2.0"
 	id "java"
@@ -454,7 +647,8 @@ sourceSets {
 """)
 
 def cleanup_gradle_scripts(targets: Collection[BuildTarget]) -> None:
-	if not GLOBALS.MAKE_CONFIG.get_value("java.configurable", False):
+	# Persistent scripts are reused by daemon between builds.
+	if not GLOBALS.MAKE_CONFIG.get_value("java.configurable", False) and not GLOBALS.MAKE_CONFIG.get_value("java.daemon", False):
 		for target in targets:
 			gradle_script = join(target.directory, "build.gradle")
 			if isfile(gradle_script):
@@ -495,24 +689,38 @@ def build_java_directories(tool: str, directories: Dict[str, BaseConfig], target
 		result = build_java_with_javac(targets, target_directory)
 	if result != 0:
 		return result
+	# Compiled classes are hashed right away, journal must not trust them.
+	for target in targets:
+		GLOBALS.CHANGE_JOURNAL.mark_written(join(target_directory, "classes", target.relative_directory))
 
-	modified_targets = update_modified_targets(targets, target_directory)
+	modified_targets, library_digests = update_modified_targets(targets, target_directory)
+	# Keys are obtained beforehand, since build storage is not shared between threads.
+	artifact_keys = dict()
+	library_keys = dict()
 	for target in targets:
+		library_keys[target.relative_directory] = get_d8_library_keys(target)
 		if target.relative_directory not in modified_targets:
 			# Otherwise it will be reported immediately.
 			if tool == "gradle":
 				info(f"* Directory {target.relative_directory!r} is not changed.")
 		else:
-			info(f"* Running d8 with {target.relative_directory!r}")
-			result = run_d8(target, modified_targets[target.relative_directory], target.classpath, target_directory)
-			if result != 0:
-				error(f"Failed to dex {target.relative_directory!r} with result {result}.")
-				return result
-			result = merge_compressed_dexes(target, target_directory)
-			if result != 0:
-				error(f"Failed to merge {target.relative_directory!r} with result {result}.")
-				return result
+			artifact_keys[target.relative_directory] = get_d8_artifact_key(target, target_directory)
+	cleanup_library_dexes((key for keys in library_keys.values() for key in keys.values()), target_directory)
+	# Dexing threads share these globals, racing threads would create them twice.
+	GLOBALS.ensure_initialized("ARTIFACT_CACHE", "D8_WORKER")
+	def dex_target(target: BuildTarget, log: TargetLog) -> int:
+		result = dex_java_target(target, modified_targets[target.relative_directory], artifact_keys[target.relative_directory], library_keys[target.relative_directory], target_directory, log)
+		# Otherwise libraries must be considered modified by next build.
+		if result == 0:
+			write_library_record(target.relative_directory, library_digests[target.relative_directory], target_directory)
+		return result
+	result = build_java_targets([
+		target for target in targets if target.relative_directory in modified_targets
+	], dex_target)
+	if result != 0:
+		return result
 
+	for target in targets:
 		built_successfully = False
 
 		target_odex_directory = join(target_directory, "odex", target.relative_directory)
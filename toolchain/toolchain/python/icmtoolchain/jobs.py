@@ -0,0 +1,55 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from . import GLOBALS, PROPERTIES
+
+T = TypeVar("T")
+
+
+def get_jobs_count(jobs: Optional[int] = None) -> int:
+	"""
+	Count of concurrently running tools, passed with `-j` option
+	or declared in configuration; processors count by default.
+	"""
+	if not jobs:
+		jobs = PROPERTIES.get_value("jobs") or GLOBALS.PREFERRED_CONFIG.get_value("development.jobs", 0)
+	if not jobs or jobs <= 0:
+		jobs = os.cpu_count() or 1
+	return jobs
+
+
+class JobScheduler:
+	"""
+	Runs jobs on limited count of workers, which is single limit for
+	everything submitted into scheduler; once any job is failed, jobs
+	that have not been started yet are cancelled.
+	"""
+	jobs: int
+
+	def __init__(self, jobs: Optional[int] = None) -> None:
+		self.jobs = get_jobs_count(jobs)
+		self.executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="job")
+		self.failure = threading.Event()
+
+	@property
+	def cancelled(self) -> bool:
+		return self.failure.is_set()
+
+	def cancel(self) -> None:
+		self.failure.set()
+
+	def submit(self, job: Callable[..., T], *args: Any, **kwargs: Any) -> 'Future[T]':
+		return self.executor.submit(job, *args, **kwargs)
+
+	def shutdown(self) -> None:
+		self.executor.shutdown(wait=True)
+
+	def __enter__(self) -> 'JobScheduler':
+		return self
+
+	def __exit__(self, type, value, traceback) -> None:
+		if value is not None:
+			self.cancel()
+		self.shutdown()
@@ -1,14 +1,29 @@
 import json
 import os
+import re
 import subprocess
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from os.path import abspath, basename, exists, isdir, isfile, join, relpath
-from typing import Collection, Dict, List, Optional
+from typing import Callable, Collection, Dict, List, Optional, Tuple
 
 from . import GLOBALS, PROPERTIES
+from .artifact_cache import ArtifactCache, get_tool_identity
+from .hash_storage import HashStorage, encode
+from .jobs import JobScheduler
 from .language import get_language_directories
 from .make_config import BaseConfig, ToolchainConfig
-from .native_setup import arch_to_abi, prepare_compiler_executable
+from .native_profile import NativeProfiler
+from .native_setup import (arch_to_abi, get_compiler_launcher,
+                           get_launcher_environment,
+                           prepare_compiler_executable)
+from .native_tracking import (DependencyDigests, get_flags_digest,
+                              get_state_digest, is_object_up_to_date,
+                              parse_dependency_file, read_object_flags,
+                              write_object_flags, write_object_state)
+from .native_unity import prepare_unity_sources
 from .shell import abort, debug, error, info, warn
 from .utils import (RuntimeCodeError, copy_directory, copy_file,
                     ensure_directory, ensure_file_directory, get_all_files,
@@ -20,6 +35,7 @@ CODE_FAILED_INVALID_MANIFEST = 1002
 CODE_DUPLICATE_NAME = 1003
 CODE_INVALID_JSON = 1004
 CODE_INVALID_PATH = 1005
+CODE_CANCELLED = 1006
 
 
 BuildTarget = namedtuple("BuildTarget", "directory relative_directory output_directory manifest stdincludes")
@@ -36,7 +52,7 @@ def collect_stdincludes_directories(directories: Optional[Collection[str]]) -> L
 			warn(f"* Skipped non-existing stdincludes directory {directory!r}, please make sure that them exist!")
 			continue
 		has_directories = False
-		for filename in os.listdir(stdincludes_directory):
+		for filename in sorted(os.listdir(stdincludes_directory)):
 			stdincludes_headers = join(stdincludes_directory, filename)
 			if isdir(stdincludes_headers):
 				stdincludes.append(stdincludes_headers)
@@ -48,36 +64,99 @@ def collect_stdincludes_directories(directories: Optional[Collection[str]]) -> L
 def get_manifest(directory: str) -> ToolchainConfig:
 	return ToolchainConfig(join(directory, "manifest"))
 
-def get_name_from_manifest(directory: str) -> Optional[str]:
-	try:
-		return get_manifest(directory).get_value("shared.name", basename(directory))
-	except:
-		return None
-
-def search_in_directory(parent: str, name: str) -> Optional[str]:
-	for dirpath, dirnames, filenames in os.walk(parent):
-		for relative_directory in dirnames:
-			path = join(dirpath, relative_directory)
-			if get_name_from_manifest(path) == name:
-				return path
-
-def get_fake_so_directory(abi: str) -> str:
-	fake_so_directory = GLOBALS.TOOLCHAIN_CONFIG.get_path(join("toolchain", "ndk", "fakeso", abi))
+class NativeDirectoryIndex:
+	"""
+	Names and shared includes of every directory inside searched parents,
+	each parent is walked once per build; found directory is reindexed
+	only when its manifest was modified and no longer declares name.
+	"""
+	names: Dict[str, Dict[str, str]]
+	manifests: Dict[str, Tuple[Optional[int], Optional[str], List[str]]]
+
+	def __init__(self) -> None:
+		self.names = dict()
+		self.manifests = dict()
+		self.lock = threading.Lock()
+
+	@staticmethod
+	def get_manifest_mtime(directory: str) -> Optional[int]:
+		try:
+			return os.stat(join(directory, "manifest")).st_mtime_ns
+		except OSError:
+			return None
+
+	def read_manifest(self, directory: str) -> Tuple[Optional[str], List[str]]:
+		mtime = NativeDirectoryIndex.get_manifest_mtime(directory)
+		if directory not in self.manifests or self.manifests[directory][0] != mtime:
+			try:
+				manifest = get_manifest(directory)
+				self.manifests[directory] = (mtime, manifest.get_value("shared.name", basename(directory)), manifest.get_list("shared.include"))
+			except:
+				self.manifests[directory] = (mtime, None, list())
+		return self.manifests[directory][1], self.manifests[directory][2]
+
+	def index(self, parent: str) -> Dict[str, str]:
+		names = dict()
+		for dirpath, dirnames, filenames in os.walk(parent):
+			for relative_directory in dirnames:
+				path = join(dirpath, relative_directory)
+				name = self.read_manifest(path)[0]
+				if name is not None and name not in names:
+					names[name] = path
+		self.names[parent] = names
+		return names
+
+	def search(self, parent: str, name: str) -> Optional[str]:
+		with self.lock:
+			names = self.names.get(parent)
+			if names is None:
+				names = self.index(parent)
+			elif name in names and self.read_manifest(names[name])[0] != name:
+				names = self.index(parent)
+			return names.get(name)
+
+	def get_includes(self, directory: str) -> List[str]:
+		with self.lock:
+			return self.read_manifest(directory)[1]
+
+FAKE_SO_LOCK = threading.Lock()
+
+def get_fake_so_directory(abi: str, executable: str) -> str:
+	"""
+	Stubs are kept apart for every compiler identity, so updating NDK
+	would not leave libraries linked against stubs of another one.
+	"""
+	identity = get_tool_identity([executable]) or executable
+	fake_so_directory = GLOBALS.TOOLCHAIN_CONFIG.get_path(join("toolchain", "ndk", "fakeso", abi, get_flags_digest([identity])[:12]))
 	ensure_directory(fake_so_directory)
 	return fake_so_directory
 
 def add_fake_so(executable: str, abi: str, name: str) -> None:
-	file = join(get_fake_so_directory(abi), "lib" + name + ".so")
-	if not isfile(file):
-		result = subprocess.call([
-			executable, "-std=c++11",
-			GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/fakeso.cpp"),
-			"-shared", "-o", file
-		])
-		if result == 0:
-			debug(f"Created linking fake so {name!r} successfully")
-		else:
-			warn(f"Stubbing fake so failed with result {result}!")
+	"""
+	Every stub is a copy of single shared object, which is compiled
+	once per compiler; stubs are created only when missing.
+	"""
+	fake_so_directory = get_fake_so_directory(abi, executable)
+	file = join(fake_so_directory, "lib" + name + ".so")
+	if isfile(file):
+		return
+	stub = join(fake_so_directory, ".stub.so")
+	with FAKE_SO_LOCK:
+		if not isfile(stub):
+			result = subprocess.call([
+				executable, "-std=c++11",
+				GLOBALS.TOOLCHAIN_CONFIG.get_path("toolchain/bin/fakeso.cpp"),
+				"-shared", "-o", stub + ".tmp"
+			])
+			if result != 0:
+				warn(f"Stubbing fake so failed with result {result}!")
+				return
+			os.replace(stub + ".tmp", stub)
+		try:
+			os.link(stub, file)
+		except OSError:
+			copy_file(stub, file)
+	debug(f"Created linking fake so {name!r} successfully")
 
 RUNTIME_ARCHES = {
 	"arm64-v8a": "aarch64",
@@ -155,8 +234,460 @@ def get_native_build_targets(directories: Dict[str, BaseConfig]) -> List[BuildTa
 
 	return targets
 
-def build_native_with_ndk(directory: str, output_directory: str, target_directory: str, abis: Collection[str], stdincludes: Collection[str], manifest: BaseConfig) -> int:
+def run_compiler(command: List[str]) -> 'subprocess.CompletedProcess[str]':
+	"""
+	Runs compilation through compiler cache launcher if it is declared,
+	launcher is started from toolchain directory to keep relative paths
+	same between builds.
+	"""
+	launcher = get_compiler_launcher()
+	if len(launcher) == 0:
+		return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	return subprocess.run(launcher + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=get_launcher_environment(), cwd=get_compiler_directory())
+
+def get_compiler_directory() -> str:
+	"""
+	Working directory of compiler started with `run_compiler`, paths
+	emitted by compiler relative to it must be resolved against it.
+	"""
+	return GLOBALS.TOOLCHAIN_CONFIG.directory if len(get_compiler_launcher()) > 0 else os.getcwd()
+
+def normalize_includes(includes: List[str]) -> List[str]:
+	"""
+	Makes include directories absolute and removes repeated ones, so
+	compiler command does not depend on how dependencies are declared.
+	"""
+	normalized_includes = list()
+	for include in includes:
+		if include.startswith("-I"):
+			include = "-I" + abspath(include[2:])
+		if include not in normalized_includes:
+			normalized_includes.append(include)
+	return normalized_includes
+
+LINE_MARKER = re.compile(r'^(# \d+ "|#pragma GCC pch_preprocess ")(.*?)(")', re.MULTILINE)
+
+def get_relocation_roots() -> List[Tuple[str, str]]:
+	roots = [
+		(abspath(GLOBALS.MAKE_CONFIG.get_build_path("")), "$BUILD"),
+		(abspath(GLOBALS.MAKE_CONFIG.directory), "$PROJECT"),
+		(abspath(GLOBALS.TOOLCHAIN_CONFIG.directory), "$TOOLCHAIN")
+	]
+	# Nested roots are substituted first, project is usually inside toolchain.
+	return sorted(roots, key=lambda root: len(root[0]), reverse=True)
+
+def relocate_path(path: str, roots: List[Tuple[str, str]]) -> str:
+	"""
+	Replaces project, build or toolchain directory prefix with
+	placeholder, other paths are kept as is.
+	"""
+	for root, placeholder in roots:
+		for prefix in (root, root.replace("\\", "\\\\")):
+			if path == prefix or path.startswith((prefix + "/", prefix + os.sep, prefix + "\\\\")):
+				return placeholder + path[len(prefix):]
+	return path
+
+def relocate_flags(flags: List[str], roots: List[Tuple[str, str]]) -> List[str]:
+	relocated_flags = list()
+	for flag in flags:
+		for root, placeholder in roots:
+			flag = flag.replace(root, placeholder)
+		relocated_flags.append(flag)
+	return relocated_flags
+
+def get_relocated_file_hash(preprocessed_file: str, roots: List[Tuple[str, str]]) -> str:
+	"""
+	Hashes preprocessed source with line markers relative to project,
+	build or toolchain directory, so objects are shared between checkouts
+	in another locations; string literals like `__FILE__` are kept.
+	"""
+	with open(preprocessed_file, encoding="utf-8", errors="surrogateescape") as file:
+		content = LINE_MARKER.sub(lambda match: match.group(1) + relocate_path(match.group(2), roots) + match.group(3), file.read())
+	return encode(content.encode("utf-8", errors="surrogateescape")).hexdigest()
+
+def compile_source_file(scheduler: JobScheduler, profiler: NativeProfiler, compiler_command: List[str], abi: str, file: str, preprocessed_file: str, object_file: str, includes: List[str], options: List[str], precompiled_digest: str = "") -> Tuple[int, str, str]:
+	"""
+	Preprocesses source and compiles it when preprocessed text changed,
+	returns result code, captured compiler output and what was done
+	with object: 'unchanged', 'restored', 'compiled', 'cancelled' or 'failed'.
+	"""
+	if scheduler.cancelled:
+		return CODE_OK, "", "cancelled"
+	# Preprocessed source already contains every included header.
+	compile_options = options + ([] if "64" in abi else ["-shared"])
+	flags = get_flags_digest([abi, precompiled_digest] + compiler_command + compile_options)
+	tmp_preprocessed_file = preprocessed_file + ".tmp"
+	with profiler.measure(file, "preprocess", abi):
+		result = subprocess.run(compiler_command + [
+			"-E", file, "-o", tmp_preprocessed_file
+		] + includes + options, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	output = result.stdout
+	if result.returncode != CODE_OK:
+		if isfile(object_file):
+			os.remove(object_file)
+		scheduler.cancel()
+		return result.returncode, output, "failed"
+
+	import filecmp
+	if isfile(preprocessed_file) and isfile(object_file) \
+			and filecmp.cmp(preprocessed_file, tmp_preprocessed_file) \
+			and read_object_flags(object_file) == flags:
+		os.remove(tmp_preprocessed_file)
+		return CODE_OK, output, "unchanged"
+	os.replace(tmp_preprocessed_file, preprocessed_file)
+	if isfile(object_file):
+		os.remove(object_file)
+
+	roots = get_relocation_roots()
+	artifact_key = ArtifactCache.get_key("gcc", get_tool_identity(compiler_command[:1]), [abi, precompiled_digest] + relocate_flags(compiler_command[1:] + compile_options, roots), get_relocated_file_hash(preprocessed_file, roots))
+	if GLOBALS.ARTIFACT_CACHE.fetch(artifact_key, object_file):
+		write_object_flags(object_file, flags)
+		return CODE_OK, output, "restored"
+	if scheduler.cancelled:
+		return CODE_OK, output, "cancelled"
+
+	# Precompiled header is only referred by pragma, which is allowed in preprocessed sources.
+	with profiler.measure(file, "compile", abi):
+		result = run_compiler(compiler_command + [
+			"-c", preprocessed_file, "-o", object_file
+		] + (["-fpreprocessed"] if precompiled_digest else []) + compile_options)
+	output += result.stdout
+	if result.returncode != CODE_OK:
+		if isfile(object_file):
+			os.remove(object_file)
+		scheduler.cancel()
+		return result.returncode, output, "failed"
+	GLOBALS.ARTIFACT_CACHE.store(artifact_key, object_file)
+	write_object_flags(object_file, flags)
+	return CODE_OK, output, "compiled"
+
+def compile_tracked_source_file(scheduler: JobScheduler, profiler: NativeProfiler, digests: DependencyDigests, compiler_command: List[str], abi: str, file: str, object_file: str, includes: List[str], options: List[str], precompiled_digest: str = "") -> Tuple[int, str, str]:
+	"""
+	Compiles source only when flags, source or any of headers listed
+	in dependency file emitted by compiler changed, so unchanged
+	translation units are not even preprocessed.
+	"""
+	if scheduler.cancelled:
+		return CODE_OK, "", "cancelled"
+	compile_options = options + ([] if "64" in abi else ["-shared"])
+	flags = get_flags_digest([abi, precompiled_digest] + compiler_command + includes + compile_options)
+	if is_object_up_to_date(object_file, flags, digests):
+		return CODE_OK, "", "unchanged"
+	dependency_file = object_file + ".d"
+	with profiler.measure(file, "compile", abi):
+		result = run_compiler(compiler_command + [
+			"-c", file, "-o", object_file, "-MMD", "-MF", dependency_file
+		] + includes + compile_options)
+	if result.returncode != CODE_OK:
+		if isfile(object_file):
+			os.remove(object_file)
+		scheduler.cancel()
+		return result.returncode, result.stdout, "failed"
+	dependencies = parse_dependency_file(dependency_file, get_compiler_directory()) if isfile(dependency_file) else list()
+	write_object_state(object_file, flags, dependencies or [file], digests)
+	return CODE_OK, result.stdout, "compiled"
+
+def build_precompiled_header(profiler: NativeProfiler, digests: DependencyDigests, compiler_command: List[str], abi: str, header: str, precompiled_directory: str, includes: List[str], options: List[str]) -> Tuple[int, str, Optional[str]]:
+	"""
+	Precompiles header through wrapper including it, so sources may
+	include wrapper and either compiler would pick precompiled header
+	or fall back to original one. Header is rebuilt only when flags or
+	any header it includes changed; returns result code, captured
+	compiler output and digest of precompiled header.
+	"""
+	wrapper = join(precompiled_directory, basename(header))
+	wrapper_content = f"#include \"{abspath(header)}\"\n"
+	if isfile(wrapper):
+		with open(wrapper, encoding="utf-8") as file:
+			if file.read() == wrapper_content:
+				wrapper_content = None
+	if wrapper_content:
+		ensure_file_directory(wrapper)
+		with open(wrapper, "w", encoding="utf-8") as file:
+			file.write(wrapper_content)
+	precompiled_header = wrapper + ".gch"
+	compile_options = options + ([] if "64" in abi else ["-shared"])
+	flags = get_flags_digest([abi] + compiler_command + includes + compile_options)
+	if not is_object_up_to_date(precompiled_header, flags, digests):
+		dependency_file = precompiled_header + ".d"
+		with profiler.measure(header, "precompile", abi):
+			result = subprocess.run(compiler_command + [
+				"-x", "c++-header", wrapper, "-o", precompiled_header, "-MMD", "-MF", dependency_file
+			] + includes + compile_options, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+		if result.returncode != CODE_OK:
+			if isfile(precompiled_header):
+				os.remove(precompiled_header)
+			return result.returncode, result.stdout, None
+		dependencies = parse_dependency_file(dependency_file) if isfile(dependency_file) else list()
+		write_object_state(precompiled_header, flags, dependencies or [header], digests)
+	# Digest is part of artifact keys of sources, so it must not depend on location of project;
+	# wrapper refers header by absolute path, header itself is recorded instead.
+	roots = get_relocation_roots()
+	relocated_flags = [abi, get_tool_identity(compiler_command[:1])] + relocate_flags(compiler_command[1:] + includes + compile_options, roots)
+	return CODE_OK, "", get_state_digest(precompiled_header, relocated_flags, lambda path: None if abspath(path) == wrapper else relocate_path(path, roots)) or HashStorage.get_file_hash(precompiled_header)
+
+def get_lto_options(executable: str, linker: Optional[str], jobs: int, cache_directory: str) -> List[str]:
+	"""
+	Linker options distributing optimization between jobs, Clang is
+	also allowed to reuse ThinLTO results in cache directory.
+	"""
+	if "clang" not in get_tool_identity([executable]).lower():
+		return [f"-flto={jobs}"]
+	if linker in ("gold", "bfd"):
+		return [f"-Wl,-plugin-opt,jobs={jobs}", f"-Wl,-plugin-opt,cache-dir={cache_directory}"]
+	return [f"-Wl,--thinlto-jobs={jobs}", f"-Wl,--thinlto-cache-dir={cache_directory}"]
+
+class NativeProgress:
+	"""
+	Reports progress of concurrently built ABIs in single line, their
+	messages are buffered and printed in order of ABIs when build is
+	completed; single ABI is reported immediately.
+	"""
+	def __init__(self, abis: Collection[str]) -> None:
+		self.concurrent = len(abis) > 1
+		self.positions = {abi: "" for abi in abis}
+		self.messages: Dict[str, List[Tuple[Callable[..., None], Tuple[object, ...]]]] = {abi: list() for abi in abis}
+		self.lock = threading.Lock()
+
+	def report(self, abi: str, printer: Callable[..., None], *values: object) -> None:
+		if not self.concurrent:
+			printer(*values)
+			return
+		with self.lock:
+			self.messages[abi].append((printer, values))
+
+	def progress(self, abi: str, relative_file: str, position: int, total: int) -> None:
+		if not self.concurrent:
+			debug(f"Compiled {relative_file} ({position}/{total}){' ' * 48}", end="\r")
+			return
+		with self.lock:
+			self.positions[abi] = f"{position}/{total}"
+			debug(f"Compiled {', '.join(f'{abi} {position}' for abi, position in self.positions.items() if position)}{' ' * 48}", end="\r")
+
+	def flush(self) -> None:
+		if self.concurrent:
+			debug(" " * 72, end="\r")
+		for abi, messages in self.messages.items():
+			if len(messages) > 0:
+				info(f"* Reported for {abi}")
+			for printer, values in messages:
+				printer(*values)
+			messages.clear()
+
+def build_native_abi(abi: str, executable: str, directory: str, target_directory: str, target: str, soname: str, make: Optional[str], manifest: BaseConfig, stdincludes: Collection[str], sources: List[Tuple[str, str]], scheduler: JobScheduler, progress: NativeProgress, digests: DependencyDigests, index: NativeDirectoryIndex, profiler: NativeProfiler) -> int:
 	configurations = manifest.get_config("configurations")
+	manifest_abi = manifest
+	options = manifest_abi.get_value("options")
+	displayed_configuration = False
+	if configurations:
+		configuration = merge_relevant_configurations(configurations, abi)
+		configuration_options = configuration.get_value("options")
+		if configuration_options and len(configuration_options) != 0:
+			progress.report(abi, debug, f"{', '.join(options or ['-std=c++11'])} (architecture configuration: {', '.join(configuration_options)})")
+			displayed_configuration = True
+		manifest_abi = BaseConfig()
+		manifest_abi.merge_config(manifest)
+		manifest_abi.merge_config(configuration)
+		options = manifest_abi.get_value("options")
+	if not options or len(options) == 0:
+		options = ["-std=c++11"]
+	if not displayed_configuration:
+		progress.report(abi, debug, ", ".join(options))
+	if profiler.time_trace and "clang" in get_tool_identity([executable]).lower():
+		options = options + ["-ftime-trace"]
+
+	compiler_command = [executable, "-DANDROID_STL=c++_static"]
+	includes = list()
+	for stdincludes_directory in reversed(list(stdincludes)):
+		includes.append(f"-I{stdincludes_directory}")
+	dependencies = [f"-L{get_fake_so_directory(abi, executable)}", "-landroid", "-lm", "-llog", "-ldl", "-lc"]
+	links = manifest_abi.get_list("link")
+	if not "horizon" in links:
+		links.append("horizon")
+	for link in links:
+		add_fake_so(executable, abi, link)
+		dependencies.append(f"-l{link}")
+
+	# Always search for dependencies in current directory.
+	search_directory = abspath(join(directory, ".."))
+	for dependency in manifest_abi.get_list("depends"):
+		if dependency:
+			add_fake_so(executable, abi, dependency)
+			dependencies.append("-l" + dependency)
+			dependency_directory = index.search(search_directory, dependency)
+			if dependency_directory:
+				for include_directory in index.get_includes(dependency_directory):
+					includes.append("-I" + join(dependency_directory, include_directory))
+		else:
+			progress.report(abi, warn, f"* Dependency directory {dependency} is not found, it will be skipped.")
+	for include in manifest_abi.get_list("include"):
+		includes.append("-I" + join(directory, include))
+	includes = normalize_includes(includes)
+
+	# Prepare output cache directories.
+	tracking = manifest_abi.get_value("dependencyTracking", False)
+	preprocessed_directory = abspath(join(target_directory, "preprocessed", abi))
+	if not tracking:
+		ensure_directory(preprocessed_directory)
+	object_directory = abspath(join(target_directory, "object", abi))
+	ensure_directory(object_directory)
+
+	# Precompile header once, sources will include it before anything else.
+	precompiled_includes = includes
+	precompiled_digest = ""
+	precompiled_header = manifest_abi.get_value("precompiledHeader")
+	if precompiled_header:
+		header = join(directory, precompiled_header)
+		if isfile(header):
+			precompiled_directory = abspath(join(target_directory, "pch", abi))
+			result, output, precompiled_digest = scheduler.submit(
+				build_precompiled_header, profiler, digests, compiler_command, abi, header, precompiled_directory, includes, options
+			).result()
+			if output and not output.isspace():
+				progress.report(abi, print, output.rstrip())
+			if result != CODE_OK:
+				progress.report(abi, error, f"Failed to precompile header {precompiled_header} with result {result}.")
+				scheduler.cancel()
+				return result
+			precompiled_includes = ["-include", join(precompiled_directory, basename(header))] + includes
+			if not tracking:
+				# Keeps preprocessed sources referring to precompiled header.
+				precompiled_includes.insert(0, "-fpch-preprocess")
+		else:
+			progress.report(abi, warn, f"* Precompiled header {precompiled_header} is not found, it will be skipped.")
+
+	# Preprocess to compile changed sources.
+	overall_result = CODE_OK
+	object_files = list()
+	jobs = list()
+	recompiled_count = 0
+	restored_count = 0
+	total_count = len(sources)
+
+	for file, relative_file in sources:
+		object_file = join(object_directory, relative_file) + ".o"
+		preprocessed_file = join(preprocessed_directory, relative_file)
+		if not tracking:
+			ensure_file_directory(preprocessed_file)
+		ensure_file_directory(object_file)
+		object_files.append(object_file)
+		# Header is precompiled as C++, so it is not suitable for C sources.
+		source_includes, source_digest = (precompiled_includes, precompiled_digest) \
+			if file.endswith(".cpp") else (includes, "")
+		jobs.append((relative_file, object_file, scheduler.submit(
+			profiler.run, file, abi, time.perf_counter(),
+			compile_tracked_source_file, scheduler, profiler, digests, compiler_command, abi, file, object_file, source_includes, options, source_digest
+		) if tracking else scheduler.submit(
+			profiler.run, file, abi, time.perf_counter(),
+			compile_source_file, scheduler, profiler, compiler_command, abi, file, preprocessed_file, object_file, source_includes, options, source_digest
+		)))
+
+	# Outputs are reported in order of sources, so they would not depend on timings.
+	for object_position, (relative_file, object_file, job) in enumerate(jobs, start=1):
+		try:
+			result, output, outcome = job.result()
+		except OSError as exc:
+			result, output, outcome = 1, str(exc), "failed"
+			scheduler.cancel()
+		if outcome == "cancelled":
+			continue
+		if output and not output.isspace():
+			progress.report(abi, print, output.rstrip())
+		if result != CODE_OK:
+			progress.report(abi, error, f"Failed to compile {relative_file} with result {result}.")
+			overall_result = result
+			continue
+		if outcome == "compiled":
+			profiler.aggregate_time_trace(object_file)
+			recompiled_count += 1
+		elif outcome == "restored":
+			restored_count += 1
+		progress.progress(abi, relative_file, object_position, total_count)
+
+	if overall_result == CODE_OK and scheduler.cancelled:
+		return CODE_CANCELLED
+	if overall_result != CODE_OK:
+		return overall_result
+	progress.report(abi, debug, f"Recompiled {recompiled_count}/{total_count} files with result {overall_result} ({'OK' if overall_result == 0 else 'ERROR'}){f', {restored_count} restored from cache' if restored_count > 0 else ''}{' ' * 48}")
+
+	for link in manifest_abi.get_list("linkStatic"):
+		link_path = GLOBALS.MAKE_CONFIG.get_path(join("static_libs", abi, link))
+		if isdir(link_path):
+			for object_file in get_all_files(link_path):
+				object_files.append(object_file)
+		elif exists(link_path):
+			object_files.append(link_path)
+		else:
+			progress.report(abi, warn, f"* Skipped static library {link}, because it was not exist.")
+
+	ensure_file_directory(target)
+
+	linking_command = list()
+	linking_command += compiler_command
+	modified_objects = join(object_directory, "modified_objects.rsp")
+	linking_command.append("@" + modified_objects)
+	if make and len(make) != 0 and not make.isspace():
+		linking_command.append(make)
+	linking_command.append("-shared")
+	linking_command.append("-Wl,-soname=" + soname)
+	linker = manifest_abi.get_value("linker")
+	if linker:
+		linking_command.append(f"-fuse-ld={linker}")
+	optimizing = any(option.startswith("-flto") for option in options)
+	if optimizing:
+		progress.report(abi, debug, "Linker time optimization is enabled")
+		linking_command += options
+	# Library is linked next to objects, since output directory is cleaned before build.
+	linked_target = join(object_directory, soname)
+	linking_command.append("-o")
+	linking_command.append(linked_target)
+	linking_command += includes
+	linking_command += dependencies
+
+	# Objects, static and stubbed libraries are linker inputs, together with command itself.
+	linking_flags = get_flags_digest(linking_command + object_files)
+	fake_so_directory = get_fake_so_directory(abi, executable)
+	linking_inputs = object_files + [
+		join(fake_so_directory, f"lib{dependency[2:]}.so") for dependency in dependencies if dependency.startswith("-l")
+	]
+	if is_object_up_to_date(linked_target, linking_flags, digests):
+		progress.report(abi, debug, "Linking skipped, because nothing changed")
+		copy_file(linked_target, target)
+		return CODE_OK
+
+	# Parallelism does not affect output, so it is not fingerprinted.
+	if optimizing:
+		lto_directory = abspath(join(target_directory, "lto", abi))
+		ensure_directory(lto_directory)
+		linking_command += get_lto_options(executable, linker, manifest_abi.get_value("ltoJobs", scheduler.jobs), lto_directory)
+
+	progress.report(abi, debug, "Linking object files")
+	with open(modified_objects, "w", encoding="utf-8") as modified:
+		modified.writelines(path.replace("\\", "\\\\") + "\n" for path in object_files)
+	with profiler.measure(soname, "link", abi):
+		result = scheduler.submit(subprocess.run, linking_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True).result()
+	if result.stdout and not result.stdout.isspace():
+		progress.report(abi, print, result.stdout.rstrip())
+	if result.returncode != CODE_OK:
+		if isfile(linked_target):
+			os.remove(linked_target)
+		scheduler.cancel()
+		return result.returncode
+	write_object_state(linked_target, linking_flags, linking_inputs, digests)
+	copy_file(linked_target, target)
+	return CODE_OK
+
+def build_native_with_ndk(directory: str, output_directory: str, target_directory: str, abis: Collection[str], stdincludes: Collection[str], manifest: BaseConfig, scheduler: Optional[JobScheduler] = None, index: Optional[NativeDirectoryIndex] = None, profiler: Optional[NativeProfiler] = None) -> int:
+	if not scheduler:
+		with JobScheduler() as scheduler:
+			return build_native_with_ndk(directory, output_directory, target_directory, abis, stdincludes, manifest, scheduler, index, profiler)
+	# Compiling threads share artifact cache, racing threads would create it twice.
+	GLOBALS.ensure_initialized("ARTIFACT_CACHE")
+	if not index:
+		index = NativeDirectoryIndex()
+	if not profiler:
+		profiler = NativeProfiler(enabled=False)
+
 	library_name = manifest.get_value("shared.name", basename(directory))
 	if len(library_name) == 0 or library_name.isspace() or (manifest.get_value("shared") and library_name == "unnamed"):
 		abort(f"Library directory {directory} uses illegal name {library_name!r}!", code=CODE_FAILED_INVALID_MANIFEST)
@@ -225,164 +756,60 @@ def build_native_with_ndk(directory: str, output_directory: str, target_director
 		targets[abi] = abspath(join(output_directory, soname)) if len(abis) == 1 \
 			else abspath(join(output_directory, "so", abi_to_runtime_architecture(abi), soname))
 
-	overall_result = CODE_OK
-	for abi in abis:
-		info(f"* Compiling {library_name!r} for {abi}")
-		manifest_abi = manifest
-		options = manifest_abi.get_value("options")
-		displayed_configuration = False
-		if configurations:
-			configuration = merge_relevant_configurations(configurations, abi)
-			configuration_options = configuration.get_value("options")
-			if configuration_options and len(configuration_options) != 0:
-				debug(f"{', '.join(options or ['-std=c++11'])} (architecture configuration: {', '.join(configuration_options)})")
-				displayed_configuration = True
-			manifest_abi = BaseConfig()
-			manifest_abi.merge_config(manifest)
-			manifest_abi.merge_config(configuration)
-			options = manifest_abi.get_value("options")
-		if not options or len(options) == 0:
-			options = ["-std=c++11"]
-		if not displayed_configuration:
-			debug(", ".join(options))
-
-		executable = prepare_compiler_executable(abi)
-		compiler_command = [executable, "-DANDROID_STL=c++_static"]
-		includes = list()
-		for stdincludes_directory in reversed(list(stdincludes)):
-			includes.append(f"-I{stdincludes_directory}")
-		dependencies = [f"-L{get_fake_so_directory(abi)}", "-landroid", "-lm", "-llog", "-ldl", "-lc"]
-		links = manifest_abi.get_list("link")
-		if not "horizon" in links:
-			links.append("horizon")
-		for link in links:
-			add_fake_so(executable, abi, link)
-			dependencies.append(f"-l{link}")
-
-		# Always search for dependencies in current directory.
-		search_directory = abspath(join(directory, ".."))
-		for dependency in manifest_abi.get_list("depends"):
-			if dependency:
-				add_fake_so(executable, abi, dependency)
-				dependencies.append("-l" + dependency)
-				dependency_directory = search_in_directory(search_directory, dependency)
-				if dependency_directory:
-					try:
-						for include_directory in get_manifest(dependency_directory).get_list("shared.include"):
-							includes.append("-I" + join(dependency_directory, include_directory))
-					except KeyError:
-						pass
-			else:
-				warn(f"* Dependency directory {dependency} is not found, it will be skipped.")
-		for include in manifest_abi.get_list("include"):
-			includes.append("-I" + join(directory, include))
-
-		# Collect files and prepare output cache directories.
-		source_files = get_all_files(directory, extensions=(".cpp", ".c"))
-		preprocessed_directory = abspath(join(target_directory, "preprocessed", abi))
-		ensure_directory(preprocessed_directory)
-		object_directory = abspath(join(target_directory, "object", abi))
-		ensure_directory(object_directory)
-
-		# Preprocess to compile changed sources.
-		import filecmp
-		object_files = list()
-		object_position = 1
-		recompiled_count = 0
-		total_count = len(source_files)
-
-		for file in source_files:
-			relative_file = relpath(file, directory)
-			debug(f"Preprocessing {relative_file} ({object_position}/{total_count}){' ' * 48}", end="\r")
-
-			object_file = join(object_directory, relative_file) + ".o"
-			preprocessed_file = join(preprocessed_directory, relative_file)
-			tmp_preprocessed_file = preprocessed_file + ".tmp"
-			ensure_file_directory(preprocessed_file)
-			ensure_file_directory(object_file)
-			object_files.append(object_file)
-
-			result = subprocess.call(compiler_command + [
-				"-E", file, "-o", tmp_preprocessed_file
-			] + includes + options)
-
-			if result == CODE_OK:
-				if not isfile(preprocessed_file) or not isfile(object_file) \
-						or not filecmp.cmp(preprocessed_file, tmp_preprocessed_file):
-					if isfile(preprocessed_file):
-						os.remove(preprocessed_file)
-					os.rename(tmp_preprocessed_file, preprocessed_file)
-					if isfile(object_file):
-						os.remove(object_file)
-
-					debug(f"Compiling {relative_file} ({object_position}/{total_count}){' ' * 48}", end="\r")
-					result = max(result, subprocess.call(compiler_command + [
-						"-c", preprocessed_file, "-o", object_file
-					] + options + ([] if "64" in abi else ["-shared"])))
-					if result != CODE_OK:
-						if isfile(object_file):
-							os.remove(object_file)
-						overall_result = result
-					else:
-						recompiled_count += 1
-			else:
-				if isfile(object_file):
-					os.remove(object_file)
-				overall_result = result
-			object_position += 1
-
-		if overall_result != CODE_OK:
-			print()
-			return overall_result
-		debug(f"Recompiled {recompiled_count}/{total_count} files with result {overall_result} ({'OK' if overall_result == 0 else 'ERROR'}){' ' * 48}")
-
-		for link in manifest_abi.get_list("linkStatic"):
-			link_path = GLOBALS.MAKE_CONFIG.get_path(join("static_libs", abi, link))
-			if isdir(link_path):
-				for object_file in get_all_files(link_path):
-					object_files.append(object_file)
-			elif exists(link_path):
-				object_files.append(link_path)
-			else:
-				warn(f"* Skipped static library {link}, because it was not exist.")
-
-		ensure_file_directory(targets[abi])
-
-		debug("Linking object files")
-		linking_command = list()
-		linking_command += compiler_command
-		modified_objects = join(target_directory, "modified_objects.rsp")
-		with open(modified_objects, "w", encoding="utf-8") as modified:
-			modified.writelines(path.replace("\\", "\\\\") + "\n" for path in object_files)
-		linking_command.append("@" + modified_objects)
-		if make and len(make) != 0 and not make.isspace():
-			linking_command.append(make)
-		linking_command.append("-shared")
-		linking_command.append("-Wl,-soname=" + soname)
-		if "-flto" in options:
-			debug("Linker time optimization is enabled")
-			linking_command += options
-		linking_command.append("-o")
-		linking_command.append(targets[abi])
-		linking_command += includes
-		linking_command += dependencies
-		overall_result = subprocess.call(linking_command)
-		if overall_result != CODE_OK:
-			break
-
-	return overall_result
+	# Collect sources once, they are shared between every ABI.
+	source_files = get_all_files(directory, extensions=(".cpp", ".c"))
+	sources = [(file, relpath(file, directory)) for file in source_files]
+	unity_build = manifest.get_value("unityBuild", False)
+	if unity_build and len(source_files) > 1:
+		batches_count = unity_build if not isinstance(unity_build, bool) else scheduler.jobs
+		sources = prepare_unity_sources(directory, join(target_directory, "unity"), source_files, batches_count)
+		debug(f"Batched {len(source_files)} sources into {len(sources)} translation units")
+
+	executables = {abi: prepare_compiler_executable(abi) for abi in abis}
+	info(f"* Compiling {library_name!r} for {', '.join(abis)}")
+	progress = NativeProgress(abis)
+	digests = DependencyDigests()
+	# Every ABI is built in own thread, while compilers are limited by scheduler.
+	with ThreadPoolExecutor(max_workers=len(abis), thread_name_prefix="abi") as executor:
+		builds = [executor.submit(
+			build_native_abi, abi, executables[abi], directory, target_directory, targets[abi], soname, make, manifest, stdincludes, sources, scheduler, progress, digests, index, profiler
+		) for abi in abis]
+		results = [build.result() for build in builds]
+	progress.flush()
+	for abi, result in zip(abis, results):
+		if result not in (CODE_OK, CODE_CANCELLED):
+			error(f"Failed to build {library_name!r} for {abi} with result {result}.")
+			return result
+	return CODE_CANCELLED if CODE_CANCELLED in results else CODE_OK
 
-def build_native_directories(abis: Collection[str], directories: Dict[str, BaseConfig], target_directory: str) -> int:
+def build_native_directories(abis: Collection[str], directories: Dict[str, BaseConfig], target_directory: str, profiler: Optional[NativeProfiler] = None) -> int:
 	targets = get_native_build_targets(directories)
 
-	for target in targets:
-		target_library_directory = join(target_directory, target.relative_directory)
-		result = build_native_with_ndk(target.directory, target.output_directory, target_library_directory, abis, target.stdincludes, target.manifest)
-		if result != 0:
-			return result
+	index = NativeDirectoryIndex()
+	with JobScheduler() as scheduler:
+		debug(f"Compiling with {scheduler.jobs} parallel jobs")
+		for target in targets:
+			target_library_directory = join(target_directory, target.relative_directory)
+			result = build_native_with_ndk(target.directory, target.output_directory, target_library_directory, abis, target.stdincludes, target.manifest, scheduler, index, profiler)
+			if result != 0:
+				return result
 
 	return 0
 
+def report_native_profile(profiler: NativeProfiler, path: str) -> None:
+	profiler.write(path)
+	slowest_files = profiler.get_slowest_files()
+	if len(slowest_files) > 0:
+		info("Slowest translation units:")
+		for file, duration in slowest_files:
+			debug(f"{duration:8.2f}s {file}")
+	slowest_headers = profiler.get_slowest_headers()
+	if len(slowest_headers) > 0:
+		info("Slowest headers:")
+		for header, duration, includes in slowest_headers:
+			debug(f"{duration:8.2f}s {header} (included {includes} times)")
+	info(f"Native build profile is written to {path}")
+
 def compile_native(abis: Collection[str]) -> int:
 	from time import time
 	startup_millis = time()
@@ -420,7 +847,11 @@ def compile_native(abis: Collection[str]) -> int:
 		GLOBALS.MOD_STRUCTURE.update_build_config_list("nativeDirs")
 		return 0
 
-	overall_result = build_native_directories(abis, directories, target_directory)
+	profiler = NativeProfiler(
+		GLOBALS.MAKE_CONFIG.get_value("development.profileNative", False),
+		GLOBALS.MAKE_CONFIG.get_value("development.nativeTimeTrace", False)
+	)
+	overall_result = build_native_directories(abis, directories, target_directory, profiler)
 
 	GLOBALS.MOD_STRUCTURE.update_build_config_list("nativeDirs")
 	startup_millis = time() - startup_millis
@@ -428,6 +859,8 @@ def compile_native(abis: Collection[str]) -> int:
 		print(f"Completed native build in {startup_millis:.2f}s!")
 	else:
 		error(f"Failed native build in {startup_millis:.2f}s with result {overall_result}.")
+	if profiler.enabled:
+		report_native_profile(profiler, GLOBALS.MAKE_CONFIG.get_build_path("native-trace.json"))
 
 	return overall_result
 
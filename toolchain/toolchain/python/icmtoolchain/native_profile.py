@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os.path import isfile, splitext
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class NativeProfiler:
+	"""
+	Collects timings of native build phases (waiting in queue, preprocessing,
+	compiling and linking) for every translation unit, which are written
+	as Chrome trace; Clang time traces of objects are aggregated to find
+	headers that take most of frontend time.
+	"""
+	events: List[Dict[str, Any]]
+	headers: Dict[str, Tuple[int, int]]
+	processes: Dict[str, int]
+
+	def __init__(self, enabled: bool = True, time_trace: bool = False) -> None:
+		self.enabled = enabled
+		self.time_trace = time_trace
+		self.events = list()
+		self.headers = dict()
+		self.processes = dict()
+		self.started = time.perf_counter()
+		self.lock = threading.Lock()
+
+	def record(self, name: str, category: str, abi: str, started: float, ended: float) -> None:
+		if not self.enabled:
+			return
+		with self.lock:
+			# Every ABI is displayed as separate process of trace.
+			if abi not in self.processes:
+				self.processes[abi] = len(self.processes) + 1
+			self.events.append({
+				"name": name,
+				"cat": category,
+				"ph": "X",
+				"ts": int((started - self.started) * 1000000),
+				"dur": int((ended - started) * 1000000),
+				"pid": self.processes[abi],
+				"tid": threading.current_thread().name,
+				"args": { "abi": abi }
+			})
+
+	@contextmanager
+	def measure(self, name: str, category: str, abi: str) -> Iterator[None]:
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(name, category, abi, started, time.perf_counter())
+
+	def run(self, name: str, abi: str, submitted: float, job: Callable[..., T], *args: Any) -> T:
+		"""
+		Runs job submitted into scheduler, time spent before it was
+		started is recorded as waiting in queue.
+		"""
+		self.record(name, "queue", abi, submitted, time.perf_counter())
+		return job(*args)
+
+	def aggregate_time_trace(self, object_file: str) -> None:
+		"""
+		Reads Clang time trace written beside object, inclusive durations
+		of parsed headers are summed between translation units.
+		"""
+		trace_file = splitext(object_file)[0] + ".json"
+		if not self.enabled or not self.time_trace or not isfile(trace_file):
+			return
+		try:
+			with open(trace_file, encoding="utf-8") as file:
+				trace = json.load(file)
+			os.remove(trace_file)
+		except (OSError, ValueError):
+			return
+		with self.lock:
+			for event in trace.get("traceEvents", list()):
+				if event.get("name") != "Source" or "detail" not in event.get("args", dict()):
+					continue
+				header = event["args"]["detail"]
+				duration, count = self.headers.get(header, (0, 0))
+				self.headers[header] = (duration + int(event.get("dur", 0)), count + 1)
+
+	def get_slowest_files(self, count: int = 10) -> List[Tuple[str, float]]:
+		durations: Dict[str, float] = dict()
+		for event in self.events:
+			if event["cat"] in ("preprocess", "compile"):
+				name = f"{event['name']} ({event['args']['abi']})"
+				durations[name] = durations.get(name, 0) + event["dur"] / 1000000
+		return sorted(durations.items(), key=lambda item: item[1], reverse=True)[:count]
+
+	def get_slowest_headers(self, count: int = 10) -> List[Tuple[str, float, int]]:
+		return sorted((
+			(header, duration / 1000000, includes) for header, (duration, includes) in self.headers.items()
+		), key=lambda item: item[1], reverse=True)[:count]
+
+	def write(self, path: str) -> None:
+		with open(path, "w", encoding="utf-8") as file:
+			json.dump({
+				"traceEvents": [{
+					"name": "process_name",
+					"ph": "M",
+					"pid": pid,
+					"args": { "name": abi }
+				} for abi, pid in self.processes.items()] + self.events,
+				"displayTimeUnit": "ms",
+				"otherData": {
+					"slowestFiles": self.get_slowest_files(),
+					"slowestHeaders": self.get_slowest_headers()
+				}
+			}, file, ensure_ascii=False)
@@ -7,7 +7,7 @@ import zipfile
 from os import environ, getenv, listdir, makedirs
 from os.path import (abspath, basename, dirname, exists, isdir, isfile, join,
                      realpath)
-from typing import Any, Generator, List, Optional, Union
+from typing import Any, Dict, Generator, List, Optional, Union
 from urllib.error import URLError
 
 from . import GLOBALS
@@ -28,6 +28,8 @@ FALLBACK_NDK_VERSIONS = {
 }
 
 GCC_EXECUTABLES = dict()
+COMPILER_LAUNCHERS = ("ccache", "sccache")
+COMPILER_LAUNCHER: Optional[List[str]] = None
 
 
 def abi_to_arch(abi: str) -> str:
@@ -160,6 +162,42 @@ def prepare_compiler_executable(abi: str) -> str:
 	GCC_EXECUTABLES[arch] = executable
 	return executable
 
+def get_compiler_launcher() -> List[str]:
+	"""
+	Compiler cache launcher declared with `native.launcher` property,
+	'auto' picks any of supported launchers available in PATH.
+	"""
+	global COMPILER_LAUNCHER
+	if COMPILER_LAUNCHER is not None:
+		return COMPILER_LAUNCHER
+	from shutil import which
+	launcher = GLOBALS.TOOLCHAIN_CONFIG.get_value("native.launcher")
+	if launcher == "auto":
+		launcher = next(filter(which, COMPILER_LAUNCHERS), None)
+	if launcher and isinstance(launcher, str):
+		executable = which(launcher) or which(GLOBALS.TOOLCHAIN_CONFIG.get_absolute_path(launcher))
+		if executable:
+			COMPILER_LAUNCHER = [executable]
+		else:
+			warn(f"* Compiler launcher {launcher!r} is not found, compiling without it.")
+			COMPILER_LAUNCHER = list()
+	else:
+		COMPILER_LAUNCHER = list()
+	return COMPILER_LAUNCHER
+
+def get_launcher_environment() -> Dict[str, str]:
+	"""
+	Makes launcher hash paths relative to toolchain and compilers by
+	their contents, so cache hits survive reinstalling NDK or moving
+	project; explicitly declared variables are kept.
+	"""
+	environment = dict(environ)
+	environment.setdefault("CCACHE_BASEDIR", GLOBALS.TOOLCHAIN_CONFIG.directory)
+	environment.setdefault("CCACHE_NOHASHDIR", "true")
+	environment.setdefault("CCACHE_COMPILERCHECK", "content")
+	environment.setdefault("SCCACHE_BASEDIRS", GLOBALS.TOOLCHAIN_CONFIG.directory)
+	return environment
+
 def check_installation(arches: Union[str, List[str]]) -> bool:
 	if not isinstance(arches, list):
 		arches = [arches]
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+from os.path import abspath, isfile, join
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .hash_storage import HashStorage, encode
+
+
+class DependencyDigests:
+	"""
+	Digests of sources and headers shared between every translation
+	unit of build, files are rehashed only when their inode, size or
+	modification time differs from recorded signature.
+	"""
+	digests: Dict[str, Tuple[List[int], str]]
+
+	def __init__(self) -> None:
+		self.digests = dict()
+		self.lock = threading.Lock()
+
+	def get_digest(self, path: str, recorded: Optional[List[Any]] = None) -> Optional[List[Any]]:
+		"""
+		Returns stat signature followed by digest, recorded one might
+		be passed to skip rehashing; None is returned when file is missing.
+		"""
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		signature = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+		with self.lock:
+			if path in self.digests and self.digests[path][0] == signature:
+				return signature + [self.digests[path][1]]
+		if isinstance(recorded, list) and len(recorded) == 4 and recorded[:3] == signature:
+			digest = recorded[3]
+		else:
+			digest = HashStorage.get_file_hash(path)
+		with self.lock:
+			self.digests[path] = (signature, digest)
+		return signature + [digest]
+
+
+def get_flags_digest(command: Iterable[str]) -> str:
+	return encode(bytes("\0".join(command), "utf-8")).hexdigest()
+
+def parse_dependency_file(path: str, directory: str = "") -> List[str]:
+	"""
+	Reads Makefile rule emitted by compiler with `-MMD`, returns list of
+	prerequisites; escaped spaces and line continuations are respected.
+	Relative prerequisites (e.g. rewritten by compiler cache) are resolved
+	against directory compiler was running in.
+	"""
+	with open(path, encoding="utf-8", errors="surrogateescape") as file:
+		content = file.read().replace("\\\r\n", " ").replace("\\\n", " ")
+	# Only first rule is relevant, phony rules of headers follow it with `-MP`.
+	rule, separator, prerequisites = next(iter(content.splitlines()), "").partition(": ")
+	if not separator:
+		return list()
+	dependencies = list()
+	buffer = ""
+	index = 0
+	while index < len(prerequisites):
+		symbol = prerequisites[index]
+		if symbol == "\\" and index + 1 < len(prerequisites) and prerequisites[index + 1] in " #":
+			buffer += prerequisites[index + 1]
+			index += 2
+			continue
+		if symbol == "$" and prerequisites[index + 1:index + 2] == "$":
+			buffer += "$"
+			index += 2
+			continue
+		if symbol.isspace():
+			if buffer:
+				dependencies.append(buffer)
+			buffer = ""
+		else:
+			buffer += symbol
+		index += 1
+	if buffer:
+		dependencies.append(buffer)
+	return [abspath(join(directory, dependency)) for dependency in dependencies]
+
+def get_flags_path(object_file: str) -> str:
+	return object_file + ".flags"
+
+def read_object_flags(object_file: str) -> Optional[str]:
+	try:
+		with open(get_flags_path(object_file), encoding="utf-8") as file:
+			return file.read().strip()
+	except OSError:
+		return None
+
+def write_object_flags(object_file: str, flags: str) -> None:
+	with open(get_flags_path(object_file), "w", encoding="utf-8") as file:
+		file.write(flags)
+
+def get_state_path(object_file: str) -> str:
+	return object_file + ".state"
+
+def read_object_state(object_file: str) -> Optional[Dict[str, Any]]:
+	try:
+		with open(get_state_path(object_file), encoding="utf-8") as file:
+			state = json.load(file)
+		return state if isinstance(state, dict) else None
+	except (OSError, ValueError):
+		return None
+
+def write_object_state(object_file: str, flags: str, dependencies: Iterable[str], digests: DependencyDigests) -> None:
+	recorded = dict()
+	for dependency in dependencies:
+		digest = digests.get_digest(dependency)
+		if digest:
+			recorded[dependency] = digest
+	with open(get_state_path(object_file), "w", encoding="utf-8") as file:
+		json.dump({
+			"flags": flags,
+			"dependencies": recorded
+		}, file, separators=(",", ":"), ensure_ascii=False)
+
+def get_state_digest(object_file: str, flags: Optional[Iterable[str]] = None, relocate: Callable[[str], Optional[str]] = lambda path: path) -> Optional[str]:
+	"""
+	Digest of flags and dependencies contents, which unlike digest
+	of object itself does not vary between identical compilations.
+	Flags and relocated paths of dependencies might be passed to make
+	digest independent from location of project, dependencies which
+	are relocated to None are skipped.
+	"""
+	state = read_object_state(object_file)
+	if not state or not isinstance(state.get("dependencies"), dict):
+		return None
+	dependencies = ((relocate(dependency), recorded) for dependency, recorded in state["dependencies"].items())
+	return get_flags_digest((list(flags) if flags is not None else [str(state.get("flags"))]) + sorted(
+		f"{dependency}={recorded[-1]}" for dependency, recorded in dependencies if dependency is not None
+	))
+
+def is_object_up_to_date(object_file: str, flags: str, digests: DependencyDigests) -> bool:
+	"""
+	Whether object was compiled with the same flags and none of
+	its recorded sources or headers changed since then.
+	"""
+	if not isfile(object_file):
+		return False
+	state = read_object_state(object_file)
+	if not state or state.get("flags") != flags:
+		return False
+	dependencies = state.get("dependencies")
+	if not isinstance(dependencies, dict) or len(dependencies) == 0:
+		return False
+	for dependency, recorded in dependencies.items():
+		digest = digests.get_digest(dependency, recorded)
+		if not digest or not isinstance(recorded, list) or digest[3] != recorded[-1]:
+			return False
+	return True
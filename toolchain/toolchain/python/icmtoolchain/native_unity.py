@@ -0,0 +1,73 @@
+import json
+import os
+from os.path import abspath, getsize, isfile, join, relpath
+from typing import Dict, List, Tuple
+
+
+def read_unity_batches(path: str) -> Tuple[int, Dict[str, int]]:
+	try:
+		with open(path, encoding="utf-8") as file:
+			batches = json.load(file)
+		return int(batches["count"]), {
+			str(file): int(batch) for file, batch in batches["files"].items()
+		}
+	except (OSError, ValueError, KeyError, TypeError, AttributeError):
+		return 0, dict()
+
+def assign_unity_batches(sizes: Dict[str, int], count: int, recorded: Dict[str, int]) -> Dict[str, int]:
+	"""
+	Assigns sources to batches, already assigned sources keep their
+	batches, so editing or adding single source affects only one of them;
+	new sources are placed into smallest batches, largest sources first.
+	"""
+	assignment = {
+		file: batch for file, batch in recorded.items() if file in sizes and 0 <= batch < count
+	}
+	totals = [0] * count
+	for file, batch in assignment.items():
+		totals[batch] += sizes[file]
+	for file in sorted((file for file in sizes if file not in assignment), key=lambda file: (-sizes[file], file)):
+		batch = min(range(count), key=lambda batch: (totals[batch], batch))
+		assignment[file] = batch
+		totals[batch] += sizes[file]
+	return assignment
+
+def prepare_unity_sources(directory: str, unity_directory: str, source_files: List[str], count: int) -> List[Tuple[str, str]]:
+	"""
+	Writes batched translation units including C++ sources into unity
+	directory, batches are rewritten only when their contents changed.
+	Returns batches followed by sources which could not be batched,
+	together with their paths relative to build directory.
+	"""
+	batched_files = [file for file in source_files if file.endswith(".cpp")]
+	standalone_files = [file for file in source_files if not file.endswith(".cpp")]
+	count = max(1, min(count, len(batched_files)))
+	os.makedirs(unity_directory, exist_ok=True)
+	batches_path = join(unity_directory, "batches.json")
+	recorded_count, recorded = read_unity_batches(batches_path)
+	sizes = {relpath(file, directory): getsize(file) for file in batched_files}
+	assignment = assign_unity_batches(sizes, count, recorded if recorded_count == count else dict())
+	with open(batches_path, "w", encoding="utf-8") as file:
+		json.dump({ "count": count, "files": assignment }, file, indent="\t", sort_keys=True)
+
+	unity_files = list()
+	for batch in range(count):
+		relative_file = join("unity", f"unity-{batch}.cpp")
+		unity_file = join(unity_directory, f"unity-{batch}.cpp")
+		content = "".join(
+			f"#include \"{abspath(join(directory, file)).replace(os.sep, '/')}\"\n"
+			for file in sorted(file for file, assigned in assignment.items() if assigned == batch)
+		)
+		if not content:
+			if isfile(unity_file):
+				os.remove(unity_file)
+			continue
+		if isfile(unity_file):
+			with open(unity_file, encoding="utf-8") as file:
+				if file.read() == content:
+					unity_files.append((unity_file, relative_file))
+					continue
+		with open(unity_file, "w", encoding="utf-8") as file:
+			file.write(content)
+		unity_files.append((unity_file, relative_file))
+	return unity_files + [(file, relpath(file, directory)) for file in standalone_files]
@@ -37,6 +37,7 @@ class Task:
 		if not silent:
 			printc(stringify(f"> Executing task: {self.name}", color=colorama.Style.BRIGHT, reset=colorama.Style.NORMAL), color=colorama.Fore.LIGHTGREEN_EX, reset=colorama.Fore.RESET)
 		result = self.callable.__call__(*args, **kwargs)
+		GLOBALS.flush_storages()
 		self.unlock()
 		return result
 
@@ -611,3 +612,42 @@ def task_cleanup() -> int:
 		return 0
 	cleanup_relative_directory("toolchain/build")
 	return 0
+
+@task(
+	"cleanupStorages",
+	locks=["cleanup"],
+	description="Evicts stale entries of build and output storages of a selected project, reporting how many of them were reclaimed."
+)
+def task_cleanup_storages(generations: int = -1, entries: int = -1) -> int:
+	for name, storage in ((".buildrc", GLOBALS.BUILD_STORAGE), (".outputrc", GLOBALS.OUTPUT_STORAGE)):
+		reclaimed = storage.cleanup(
+			generations if generations >= 0 else None,
+			entries if entries >= 0 else None
+		)
+		print(f"Reclaimed {reclaimed} entries of {name!r}.")
+	return 0
+
+@task(
+	"startWatcher",
+	description="Starts background watcher of a selected project, which journals changed files, so they are not rehashed during next builds."
+)
+def task_start_watcher() -> int:
+	from .watcher import start_watcher
+	if GLOBALS.CHANGE_JOURNAL.is_alive():
+		print("Watcher is already running.")
+		return 0
+	start_watcher(GLOBALS.CHANGE_JOURNAL.path, GLOBALS.get_watched_directories())
+	print("Watcher started.")
+	return 0
+
+@task(
+	"stopWatcher",
+	description="Stops background watcher of a selected project."
+)
+def task_stop_watcher() -> int:
+	from .watcher import stop_watcher
+	if stop_watcher(GLOBALS.CHANGE_JOURNAL.path):
+		print("Watcher will be stopped in a moment.")
+	else:
+		print("Watcher is not running.")
+	return 0
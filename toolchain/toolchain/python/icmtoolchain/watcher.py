@@ -0,0 +1,410 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from abc import ABC, abstractmethod
+from os.path import abspath, basename, dirname, exists, getmtime, isdir, isfile, join
+from typing import Dict, Final, List, Optional, Tuple
+
+# Journal might grow without limit when nobody builds project for
+# a long time, it is reset after exceeding this count of changes.
+MAX_JOURNAL_CHANGES = 65536
+# Watcher updates alive marker periodically, journal is considered
+# abandoned when marker is not updated for longer time.
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_TIMEOUT = 15.0
+# Time given to watcher to process synchronization request.
+SYNCHRONIZATION_TIMEOUT = 3.0
+# Coarsest timestamp resolution of supported filesystems (FAT), files
+# modified that close to synchronization are checked once again.
+TIMESTAMP_PRECISION = 2000000000
+
+IGNORED_NAMES = (".buildrc", ".outputrc", ".journal")
+
+
+def is_ignored_name(name: str) -> bool:
+	return name.startswith(IGNORED_NAMES)
+
+def is_related_path(path: str, other: str) -> bool:
+	return path == other or path.startswith(other + os.sep) or other.startswith(path + os.sep)
+
+
+class ChangeJournal:
+	"""
+	Reader of changes collected by background watcher, allows
+	storages to skip hashing of paths which definitely were not
+	touched since digests of them were computed.
+	"""
+	path: Final[str]
+	roots: List[str]
+	horizon: int
+	synced: int
+	changes: Dict[str, int]
+	unwatched: List[str]
+	written: List[str]
+	available: Optional[bool]
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self.roots = list()
+		self.horizon = 0
+		self.synced = 0
+		self.changes = dict()
+		self.unwatched = list()
+		self.written = list()
+		self.available = None
+
+	def is_alive(self) -> bool:
+		try:
+			return time.time() - getmtime(self.path + ".alive") < HEARTBEAT_TIMEOUT
+		except OSError:
+			return False
+
+	def read(self) -> bool:
+		try:
+			with open(self.path, encoding="utf-8") as file:
+				journal = json.load(file)
+			self.roots = journal["roots"]
+			self.horizon = journal["horizon"]
+			self.synced = journal["synced"]
+			self.changes = journal["changes"]
+			self.unwatched = journal.get("unwatched", list())
+			return True
+		except (OSError, ValueError, KeyError, TypeError):
+			return False
+
+	def synchronize(self) -> bool:
+		"""
+		Requests watcher to flush collected changes and waits until
+		journal becomes consistent with current moment; result is kept
+		until journal is invalidated, at least after every task.
+		"""
+		if self.available is not None:
+			return self.available
+		self.available = False
+		if not exists(self.path) or not self.is_alive():
+			return False
+		# Everything written before request will be contained in journal.
+		self.written = list()
+		requested = time.time_ns()
+		with open(self.path + ".request", "w", encoding="utf-8") as file:
+			file.write(str(requested))
+		deadline = time.time() + SYNCHRONIZATION_TIMEOUT
+		while time.time() < deadline:
+			if self.read() and self.synced >= requested:
+				self.available = True
+				break
+			time.sleep(0.05)
+		return self.available
+
+	def invalidate(self) -> None:
+		"""
+		Forces following queries to synchronize journal again, files
+		might be written by toolchain itself since previous request.
+		"""
+		self.available = None
+
+	def mark_written(self, path: str) -> None:
+		"""
+		Notifies that toolchain wrote into path, journal will be
+		synchronized again before anything related to it is queried.
+		"""
+		self.written.append(abspath(path))
+
+	def is_modified_after_synchronization(self, path: str) -> bool:
+		"""
+		Whether file might be written after journal was synchronized,
+		status change time is updated even when modification time
+		of copied file is preserved.
+		"""
+		if not self.available:
+			return False
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return True
+		return max(stat.st_mtime_ns, stat.st_ctime_ns) >= self.synced - TIMESTAMP_PRECISION
+
+	def is_unchanged(self, path: str, since: int) -> bool:
+		"""
+		Whether path is watched and there is no changes of it, any of
+		nested paths or parent directories after specified time. Journal
+		is synchronized once per task and again only for paths marked as
+		written by toolchain or files modified after synchronization.
+		"""
+		if since <= 0:
+			return False
+		path = abspath(path)
+		if any(is_related_path(path, written) for written in self.written) \
+				or (isfile(path) and self.is_modified_after_synchronization(path)):
+			self.invalidate()
+		if not self.synchronize() or self.horizon > since:
+			return False
+		if not any(path == root or path.startswith(root + os.sep) for root in self.roots):
+			return False
+		if any(is_related_path(path, unwatched) for unwatched in self.unwatched):
+			return False
+		for changed_path, changed_at in self.changes.items():
+			if changed_at > since and is_related_path(path, changed_path):
+				return False
+		return True
+
+
+class Watcher(ABC):
+	journal: Final[str]
+	roots: Final[List[str]]
+	horizon: int
+	changes: Dict[str, int]
+	unwatched: List[str]
+
+	def __init__(self, journal: str, roots: List[str]) -> None:
+		self.journal = journal
+		self.roots = roots
+		self.horizon = time.time_ns()
+		self.changes = dict()
+		self.unwatched = list()
+
+	def record(self, path: str) -> None:
+		if is_ignored_name(basename(path)):
+			return
+		self.changes[path] = time.time_ns()
+		if len(self.changes) > MAX_JOURNAL_CHANGES:
+			self.reset()
+
+	def reset(self) -> None:
+		self.changes = dict()
+		self.horizon = time.time_ns()
+
+	def record_unwatched(self, path: Optional[str]) -> None:
+		"""
+		Directories which could not be watched or listed (e.g. watch limit
+		was exceeded or access denied) are never trusted by journal.
+		"""
+		if path and path not in self.unwatched:
+			self.unwatched.append(path)
+
+	def write(self, synced: int) -> None:
+		temporary_journal = self.journal + ".tmp"
+		with open(temporary_journal, "w", encoding="utf-8") as file:
+			json.dump({
+				"pid": os.getpid(),
+				"method": type(self).__name__,
+				"roots": self.roots,
+				"horizon": self.horizon,
+				"synced": synced,
+				"changes": self.changes,
+				"unwatched": self.unwatched
+			}, file, separators=(",", ":"), ensure_ascii=False)
+		os.replace(temporary_journal, self.journal)
+
+	def heartbeat(self) -> None:
+		with open(self.journal + ".alive", "w", encoding="utf-8") as file:
+			file.write(str(os.getpid()))
+
+	def requested_at(self) -> int:
+		try:
+			with open(self.journal + ".request", encoding="utf-8") as file:
+				return int(file.read().strip() or 0)
+		except (OSError, ValueError):
+			return 0
+
+	@abstractmethod
+	def collect(self, timeout: float) -> None:
+		"""
+		Records changes received during timeout, zero timeout means
+		that everything happened until now must be recorded.
+		"""
+
+	def run(self) -> None:
+		self.write(time.time_ns())
+		synced = 0
+		heartbeat_at = 0.0
+		while exists(dirname(self.journal)) and not exists(self.journal + ".stop"):
+			if time.time() - heartbeat_at >= HEARTBEAT_INTERVAL:
+				self.heartbeat()
+				heartbeat_at = time.time()
+			requested = self.requested_at()
+			if requested > synced:
+				# Everything changed before request is already queued or will be found by scan.
+				synchronizing = time.time_ns()
+				self.collect(0)
+				self.write(synchronizing)
+				synced = synchronizing
+			else:
+				self.collect(0.25)
+		for suffix in (".alive", ".stop", ".request"):
+			try:
+				os.remove(self.journal + suffix)
+			except OSError:
+				pass
+
+
+class PollingWatcher(Watcher):
+	"""
+	Fallback watcher, compares snapshots of file signatures; it scans
+	roots only on synchronization requests, so idle watcher is cheap.
+	"""
+	snapshot: Dict[str, Tuple[int, int, int]]
+
+	def __init__(self, journal: str, roots: List[str]) -> None:
+		Watcher.__init__(self, journal, roots)
+		self.snapshot = self.scan()
+
+	def scan(self) -> Dict[str, Tuple[int, int, int]]:
+		snapshot = dict()
+		for root in self.roots:
+			for dirpath, dirnames, filenames in os.walk(root, onerror=lambda exc: self.record_unwatched(exc.filename)):
+				for name in dirnames + filenames:
+					path = join(dirpath, name)
+					try:
+						stat = os.stat(path)
+						snapshot[path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns if name in filenames else 0)
+					except OSError:
+						pass
+		return snapshot
+
+	def collect(self, timeout: float) -> None:
+		if timeout > 0:
+			time.sleep(timeout)
+			return
+		snapshot = self.scan()
+		for path, signature in snapshot.items():
+			if self.snapshot.get(path) != signature:
+				self.record(path)
+		for path in self.snapshot:
+			if path not in snapshot:
+				self.record(path)
+		self.snapshot = snapshot
+
+
+class InotifyWatcher(Watcher):
+	"""
+	Linux watcher, which receives changes from kernel immediately;
+	every directory in roots is watched separately.
+	"""
+	IN_MODIFY = 0x00000002
+	IN_ATTRIB = 0x00000004
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_FROM = 0x00000040
+	IN_MOVED_TO = 0x00000080
+	IN_CREATE = 0x00000100
+	IN_DELETE = 0x00000200
+	IN_DELETE_SELF = 0x00000400
+	IN_MOVE_SELF = 0x00000800
+	IN_Q_OVERFLOW = 0x00004000
+	IN_IGNORED = 0x00008000
+	IN_ISDIR = 0x40000000
+	IN_NONBLOCK = 0x00000800
+	IN_CLOEXEC = 0x00080000
+	WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+		IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+	descriptors: Dict[int, str]
+
+	def __init__(self, journal: str, roots: List[str]) -> None:
+		import ctypes
+		import ctypes.util
+		Watcher.__init__(self, journal, roots)
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		self.descriptors = dict()
+		for root in roots:
+			self.watch_tree(root)
+
+	def watch(self, directory: str) -> None:
+		descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+		if descriptor >= 0:
+			self.descriptors[descriptor] = directory
+		else:
+			self.record_unwatched(directory)
+
+	def watch_tree(self, directory: str) -> None:
+		for dirpath, dirnames, filenames in os.walk(directory, onerror=lambda exc: self.record_unwatched(exc.filename)):
+			self.watch(dirpath)
+
+	def collect(self, timeout: float) -> None:
+		import select
+		import struct
+		while True:
+			readable, _, _ = select.select([self.fd], [], [], timeout)
+			if not readable:
+				return
+			try:
+				buffer = os.read(self.fd, 65536)
+			except BlockingIOError:
+				return
+			offset = 0
+			while offset < len(buffer):
+				descriptor, mask, cookie, length = struct.unpack_from("iIII", buffer, offset)
+				name = buffer[offset + 16:offset + 16 + length].rstrip(b"\0")
+				offset += 16 + length
+				if mask & self.IN_Q_OVERFLOW:
+					# Some events were lost, journal cannot be trusted before that moment.
+					self.reset()
+					continue
+				directory = self.descriptors.get(descriptor)
+				if not directory:
+					continue
+				if mask & self.IN_IGNORED:
+					del self.descriptors[descriptor]
+					continue
+				path = join(directory, os.fsdecode(name)) if name else directory
+				self.record(path)
+				if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+					self.watch_tree(path)
+			timeout = 0
+
+
+def get_journal_path(build_directory: str) -> str:
+	return join(build_directory, ".journal")
+
+def start_watcher(journal: str, roots: List[str]) -> None:
+	"""
+	Spawns detached watcher process, which lives until project build
+	directory is removed or watcher is stopped.
+	"""
+	os.makedirs(dirname(journal), exist_ok=True)
+	try:
+		os.remove(journal + ".stop")
+	except OSError:
+		pass
+	# Marks watcher alive before it is spawned, so it would not be started twice.
+	open(journal + ".alive", "w").close()
+	kwargs = dict()
+	if platform.system() == "Windows":
+		kwargs["creationflags"] = getattr(subprocess, "DETACHED_PROCESS", 0) | getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+	else:
+		kwargs["start_new_session"] = True
+	subprocess.Popen([
+		sys.executable, "-m", "icmtoolchain.watcher", journal
+	] + roots, cwd=abspath(join(dirname(__file__), "..")), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+def stop_watcher(journal: str) -> bool:
+	if not ChangeJournal(journal).is_alive():
+		return False
+	open(journal + ".stop", "w").close()
+	return True
+
+def watch(journal: str, roots: List[str]) -> None:
+	roots = [abspath(root) for root in roots if isdir(root)]
+	# Nested roots are already watched by their parents.
+	roots = [root for root in roots if not any(root != other and root.startswith(other + os.sep) for other in roots)]
+	watcher: Watcher
+	try:
+		if platform.system() != "Linux":
+			raise OSError("inotify is available only on Linux")
+		watcher = InotifyWatcher(journal, roots)
+	except (OSError, AttributeError):
+		watcher = PollingWatcher(journal, roots)
+	watcher.run()
+
+
+if __name__ == "__main__":
+	if len(sys.argv) < 3:
+		print("Usage: python -m icmtoolchain.watcher <journal> <root> ...")
+		exit(1)
+	watch(sys.argv[1], sys.argv[2:])